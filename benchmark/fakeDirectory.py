@@ -0,0 +1,147 @@
+import random
+
+from ldapHelper import LdapException, LdapAttributeDecoder
+
+class FakeDirectory:
+    """
+    Generates linuxmuster-like schools with users, adminclasses and projects.
+    Every user is member of one class, every project contains some classes (nested) and some users.
+    """
+
+    def __init__(self, schools, usersPerSchool, classesPerSchool, projectsPerSchool, aliasesPerUser, seed=1):
+        self._random = random.Random(seed)
+        self.users = {}
+        self.groups = {}
+
+        for school in range(schools):
+            domain = f"school{school}.example"
+            ou = f"OU=school{school},DC=linuxmuster,DC=lan"
+
+            classDns = []
+            for schoolClass in range(classesPerSchool):
+                classDns.append(self._addGroup(f"class{schoolClass}", domain, ou, "adminclass"))
+
+            projectDns = []
+            for project in range(projectsPerSchool):
+                projectDn = self._addGroup(f"project{project}", domain, ou, "project")
+                projectDns.append(projectDn)
+                for classDn in self._random.sample(classDns, min(2, len(classDns))):
+                    self._addMembership(self.groups[classDn], projectDn)
+
+            for user in range(usersPerSchool):
+                dn = f"CN=user{user},OU=students,{ou}"
+                entry = {
+                    "distinguishedName": dn,
+                    "mail": f"user{user}@{domain}",
+                    "sophomorixRole": "student",
+                    "sophomorixStatus": "U",
+                    "sophomorixMailQuotaCalculated": "500",
+                    "displayName": f"User {user} of school {school}"
+                }
+                aliases = [f"alias{alias}.user{user}@{domain}" for alias in range(aliasesPerUser)]
+                if len(aliases) == 1:
+                    entry["proxyAddresses"] = aliases[0]
+                elif len(aliases) > 1:
+                    entry["proxyAddresses"] = aliases
+
+                if classDns:
+                    self._addMembership(entry, self._random.choice(classDns))
+                if projectDns and self._random.random() < 0.1:
+                    self._addMembership(entry, self._random.choice(projectDns))
+                self.users[dn] = entry
+
+    def applyChurn(self, ratio):
+        """
+        Changes ratio of all users: a third is deactivated, a third renamed and a third gets a new quota
+        :returns: number of changed users
+        """
+        changedUsers = self._random.sample(list(self.users.values()), int(len(self.users) * ratio))
+        for i, user in enumerate(changedUsers):
+            if i % 3 == 0:
+                user["sophomorixStatus"] = "L" if user["sophomorixStatus"] == "U" else "U"
+            elif i % 3 == 1:
+                user["displayName"] += " (renamed)"
+            else:
+                user["sophomorixMailQuotaCalculated"] = str(int(user["sophomorixMailQuotaCalculated"]) + 100)
+        return len(changedUsers)
+
+    def addCrossDomainAliases(self, ratio):
+        """
+        Gives ratio of the users of the first school an alias in the domain of the second school
+        :returns: number of changed users
+        """
+        users = [user for user in self.users.values() if user["mail"].endswith("@school0.example")]
+        changedUsers = self._random.sample(users, int(len(users) * ratio))
+        for user in changedUsers:
+            aliases = user.get("proxyAddresses", [])
+            if not isinstance(aliases, list):
+                aliases = [aliases]
+            aliases.append(user["mail"].replace("@school0.example", ".school0@school1.example"))
+            user["proxyAddresses"] = aliases[0] if len(aliases) == 1 else aliases
+        return len(changedUsers)
+
+    def _addGroup(self, name, domain, ou, groupType):
+        dn = f"CN={name},OU=groups,{ou}"
+        self.groups[dn] = {
+            "distinguishedName": dn,
+            "mail": f"{name}@{domain}",
+            "sAMAccountName": f"{name}-{domain}",
+            "sophomorixType": groupType,
+            "sophomorixMailList": "TRUE"
+        }
+        return dn
+
+    def _addMembership(self, entry, groupDn):
+        memberOf = entry.get("memberOf", [])
+        if not isinstance(memberOf, list):
+            memberOf = [memberOf]
+        memberOf.append(groupDn)
+        entry["memberOf"] = memberOf[0] if len(memberOf) == 1 else memberOf
+
+class FakeLdapHelper:
+    """
+    Stand-in for LdapHelper which answers the searches of the syncer from a FakeDirectory.
+    Entries are encoded like python-ldap returns them and decoded with the attribute schema of the syncer,
+    so the returned shapes and the decoding work are the same as with LdapHelper.
+    """
+
+    def __init__(self, directory, syncerClass):
+        self._directory = directory
+        self._syncerClass = syncerClass
+        self._decoder = LdapAttributeDecoder(syncerClass.ldapAttributeSchema)
+        self.searchCount = 0
+
+    def bind(self):
+        return True
+
+    def unbind(self):
+        pass
+
+    def search(self, filter, attrlist=None):
+        results = list(self.searchPaged(filter, attrlist))
+        if len(results) <= 0:
+            return False, None
+        return True, results
+
+    def searchPaged(self, filter, attrlist=None, pageSize=None):
+        self.searchCount += 1
+        if filter == self._syncerClass.ldapUserFilter:
+            entries = self._directory.users.values()
+        elif filter == self._syncerClass.ldapGroupFilter:
+            entries = self._directory.groups.values()
+        elif filter == self._syncerClass.ldapMailingListFilter:
+            entries = [group for group in self._directory.groups.values() if group["sophomorixType"] in ["adminclass", "project"]]
+        else:
+            raise LdapException(f"Unsupported filter {filter}")
+
+        for entry in entries:
+            yield self._decoder.decode(self._encode(entry, attrlist), attrlist)
+
+    def _encode(self, entry, attrlist):
+        rawResult = {}
+        for attribute, value in entry.items():
+            if attrlist != None and attribute not in attrlist:
+                continue
+            values = value if isinstance(value, list) else [value]
+            rawResult[attribute] = [str(item).encode() for item in values]
+        return rawResult
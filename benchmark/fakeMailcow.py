@@ -0,0 +1,228 @@
+import argparse, json, logging, threading, time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-memory stand-in for the parts of the mailcow API which are used by MailcowHelper.
+# GET responses have the same keys as mailcow (including a few unused ones, to get realistic sizes).
+# GET /benchmark/stats returns the request counts, POST /benchmark/reset clears data and counts.
+
+class FakeMailcow:
+    def __init__(self, latency=0):
+        self._latency = latency
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._domains = {}
+            self._mailboxes = {}
+            self._aliases = {}
+            self._filters = {}
+            self._nextId = 1
+            self._requestCounts = {}
+
+    def getStats(self):
+        with self._lock:
+            return {
+                "requests": dict(self._requestCounts),
+                "domains": len(self._domains),
+                "mailboxes": len(self._mailboxes),
+                "aliases": len(self._aliases),
+                "filters": len(self._filters)
+            }
+
+    def handle(self, method, path, data):
+        parts = path.strip("/").split("/")
+        if len(parts) < 4 or parts[:2] != ["api", "v1"]:
+            return 404, {"type": "error", "msg": "not found"}
+
+        action, elementType = parts[2], parts[3]
+        with self._lock:
+            counter = f"{method} {action}/{elementType}"
+            self._requestCounts[counter] = self._requestCounts.get(counter, 0) + 1
+
+        if self._latency > 0:
+            time.sleep(self._latency)
+
+        with self._lock:
+            try:
+                if method == "GET" and action == "get":
+                    return 200, self._getAll(elementType)
+                elif method == "POST" and action == "add":
+                    self._add(elementType, data)
+                elif method == "POST" and action == "edit":
+                    self._edit(elementType, data["attr"], data["items"])
+                elif method == "POST" and action == "delete":
+                    self._delete(elementType, data)
+                else:
+                    return 404, {"type": "error", "msg": "not found"}
+            except (KeyError, ValueError) as e:
+                return 200, [{"type": "danger", "msg": ["benchmark_error", str(e)]}]
+
+        return 200, [{"type": "success", "msg": [f"{elementType}_{action}ed"]}]
+
+    def _getAll(self, elementType):
+        if elementType == "domain":
+            return list(self._domains.values())
+        elif elementType == "mailbox":
+            return list(self._mailboxes.values())
+        elif elementType == "alias":
+            return list(self._aliases.values())
+        elif elementType == "filters":
+            return list(self._filters.values())
+        raise KeyError(elementType)
+
+    def _add(self, elementType, data):
+        if elementType == "domain":
+            if data["domain"] in self._domains:
+                raise ValueError("domain_exists")
+            self._domains[data["domain"]] = self._setDomainValues({"domain_name": data["domain"]}, data)
+        elif elementType == "mailbox":
+            username = f"{data['local_part']}@{data['domain']}"
+            if username in self._mailboxes:
+                raise ValueError("object_exists")
+            self._mailboxes[username] = self._setMailboxValues({
+                "username": username,
+                "domain": data["domain"],
+                "local_part": data["local_part"],
+                "attributes": {"force_pw_update": "0", "tls_enforce_in": "0", "tls_enforce_out": "0", "sogo_access": "1"},
+                "last_imap_login": 0,
+                "messages": 0,
+                "spam_aliases": 0,
+                "rl": False
+            }, data)
+        elif elementType == "alias":
+            if any(alias["address"] == data["address"] for alias in self._aliases.values()):
+                raise ValueError("is_alias_or_mailbox")
+            aliasId = self._getNextId()
+            self._aliases[aliasId] = self._setAliasValues({
+                "id": aliasId,
+                "address": data["address"],
+                "domain": data["address"].split("@")[-1]
+            }, data)
+        elif elementType == "filter":
+            filterId = self._getNextId()
+            self._filters[filterId] = self._setFilterValues({"id": filterId}, data)
+        else:
+            raise KeyError(elementType)
+
+    def _edit(self, elementType, attr, items):
+        for item in items:
+            if elementType == "domain":
+                self._setDomainValues(self._domains[item], attr)
+            elif elementType == "mailbox":
+                self._setMailboxValues(self._mailboxes[item], attr)
+            elif elementType == "alias":
+                self._setAliasValues(self._findAlias(item), attr)
+            elif elementType == "filter":
+                self._setFilterValues(self._filters[int(item)], attr)
+            else:
+                raise KeyError(elementType)
+
+    def _delete(self, elementType, items):
+        for item in items:
+            if elementType == "domain":
+                del self._domains[item]
+            elif elementType == "mailbox":
+                del self._mailboxes[item]
+            elif elementType == "alias":
+                del self._aliases[self._findAlias(item)["id"]]
+            elif elementType == "filter":
+                del self._filters[int(item)]
+            else:
+                raise KeyError(elementType)
+
+    def _findAlias(self, item):
+        # aliases can be addressed by id or by address
+        if str(item).isdigit():
+            return self._aliases[int(item)]
+        for alias in self._aliases.values():
+            if alias["address"] == item:
+                return alias
+        raise KeyError(item)
+
+    def _setDomainValues(self, domain, data):
+        mebibyte = 1024 * 1024
+        keyNames = {
+            "description": ("description", str),
+            "active": ("active", int),
+            "gal": ("gal", int),
+            "mailboxes": ("max_num_mboxes_for_domain", int),
+            "aliases": ("max_num_aliases_for_domain", int),
+            "maxquota": ("max_quota_for_mbox", lambda value: int(value) * mebibyte),
+            "defquota": ("def_quota_for_mbox", lambda value: int(value) * mebibyte),
+            "quota": ("max_quota_for_domain", lambda value: int(value) * mebibyte)
+        }
+        for key, (getKey, convert) in keyNames.items():
+            if key in data:
+                domain[getKey] = convert(data[key])
+        return domain
+
+    def _setMailboxValues(self, mailbox, data):
+        for key in ["active", "name"]:
+            if key in data:
+                mailbox[key] = data[key]
+        if "quota" in data:
+            mailbox["quota"] = int(data["quota"]) * 1024 * 1024
+        return mailbox
+
+    def _setAliasValues(self, alias, data):
+        for key in ["goto", "active", "sogo_visible"]:
+            if key in data:
+                alias[key] = data[key]
+        return alias
+
+    def _setFilterValues(self, filter, data):
+        for key in ["active", "username", "filter_type", "script_data", "script_desc"]:
+            if key in data:
+                filter[key] = data[key]
+        return filter
+
+    def _getNextId(self):
+        nextId = self._nextId
+        self._nextId += 1
+        return nextId
+
+class _FakeMailcowRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    fakeMailcow = None
+
+    def do_GET(self):
+        if self.path == "/benchmark/stats":
+            self._sendJson(200, self.fakeMailcow.getStats())
+            return
+        self._sendJson(*self.fakeMailcow.handle("GET", self.path, None))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length)) if length > 0 else None
+        if self.path == "/benchmark/reset":
+            self.fakeMailcow.reset()
+            self._sendJson(200, {})
+            return
+        self._sendJson(*self.fakeMailcow.handle("POST", self.path, data))
+
+    def _sendJson(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def serve(port, latency=0, address="127.0.0.1"):
+    handler = type("FakeMailcowRequestHandler", (_FakeMailcowRequestHandler,), {"fakeMailcow": FakeMailcow(latency)})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake mailcow API for benchmarking")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="artificial latency per request in seconds")
+    args = parser.parse_args()
+    serve(args.port, args.latency)
@@ -0,0 +1,153 @@
+import argparse, json, logging, multiprocessing, os, sys, time, tracemalloc, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fakeMailcow, metricsHelper
+
+from fakeDirectory import FakeDirectory, FakeLdapHelper
+
+# Runs the syncer against a fake mailcow API (in a separate process) and a generated directory
+# and reports timings, request counts and peak memory for these scenarios:
+# - cold import: mailcow is empty
+# - no-op: nothing has changed
+# - mass change: a part of the users was changed
+# - cross-domain aliases: users of the first school get aliases in the domain of the second one (needs --schools 2 or more)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the linuxmuster-mailcow sync")
+    parser.add_argument("--schools", type=int, default=1)
+    parser.add_argument("--users", type=int, default=500, help="users per school")
+    parser.add_argument("--classes", type=int, default=20, help="adminclasses per school")
+    parser.add_argument("--projects", type=int, default=10, help="projects per school")
+    parser.add_argument("--aliases", type=int, default=1, help="aliases per user")
+    parser.add_argument("--churn", type=float, default=0.2, help="ratio of users changed in the mass change scenario")
+    parser.add_argument("--latency", type=float, default=0, help="artificial latency of the fake mailcow API in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="value of LINUXMUSTER_MAILCOW_API_WORKERS")
+    parser.add_argument("--shard", action="store_true", help="sync every domain independently (LINUXMUSTER_MAILCOW_SHARD_BY_DOMAIN)")
+    parser.add_argument("--async-engine", action="store_true", help="use the asyncio engine (LINUXMUSTER_MAILCOW_ASYNC_ENGINE)")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--memory", action="store_true", help="trace the peak memory (slows down the sync considerably)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    apiUri = f"http://127.0.0.1:{args.port}"
+    server = multiprocessing.Process(target=fakeMailcow.serve, args=(args.port, args.latency), daemon=True)
+    server.start()
+    _waitForServer(apiUri)
+
+    try:
+        results = _runScenarios(args, apiUri)
+    finally:
+        server.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _printResults(results)
+
+def _runScenarios(args, apiUri):
+    _configureEnvironment(apiUri, args.workers, args.shard, args.async_engine)
+
+    # imported here, so the environment is set before the syncer module configures logging
+    from syncer import LinuxmusterMailcowSyncer
+    logging.getLogger().setLevel(logging.WARNING)
+
+    directory = FakeDirectory(args.schools, args.users, args.classes, args.projects, args.aliases)
+    ldapHelper = FakeLdapHelper(directory, LinuxmusterMailcowSyncer)
+    syncer = LinuxmusterMailcowSyncer(ldapHelper=ldapHelper, applyTemplates=False)
+
+    results = []
+    results.append(_runScenario("cold import", syncer, ldapHelper, apiUri, args.memory))
+    results.append(_runScenario("no-op", syncer, ldapHelper, apiUri, args.memory))
+    changedUsers = directory.applyChurn(args.churn)
+    results.append(_runScenario(f"mass change ({changedUsers} users)", syncer, ldapHelper, apiUri, args.memory))
+    results.append(_runScenario("no-op after change", syncer, ldapHelper, apiUri, args.memory))
+    if args.schools > 1:
+        changedUsers = directory.addCrossDomainAliases(args.churn)
+        results.append(_runScenario(f"cross-domain aliases ({changedUsers} users)", syncer, ldapHelper, apiUri, args.memory))
+        results.append(_runScenario("no-op after cross-domain aliases", syncer, ldapHelper, apiUri, args.memory))
+    syncer.close()
+    return results
+
+def _runScenario(name, syncer, ldapHelper, apiUri, traceMemory):
+    requestsBefore = _getStats(apiUri)["requests"]
+    ldapSearchesBefore = ldapHelper.searchCount
+    for step in ["ad_load", "mailcow_load", "delta_calculation", "apply"]:
+        metricsHelper.syncStepDuration.set(0, step=step)
+
+    if traceMemory:
+        tracemalloc.start()
+
+    start = time.monotonic()
+    success = syncer._runSync()
+    duration = time.monotonic() - start
+
+    peakMemory = None
+    if traceMemory:
+        _, peakMemory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    stats = _getStats(apiUri)
+    requests = {key: value - requestsBefore.get(key, 0) for key, value in stats["requests"].items()}
+
+    return {
+        "scenario": name,
+        "success": success,
+        "duration": duration,
+        "steps": {step: metricsHelper.syncStepDuration.get(step=step) for step in ["ad_load", "mailcow_load", "delta_calculation", "apply"]},
+        "mailcowRequests": {key: value for key, value in requests.items() if value > 0},
+        "ldapSearches": ldapHelper.searchCount - ldapSearchesBefore,
+        "peakMemoryMiB": None if peakMemory == None else peakMemory / 1024 / 1024,
+        "mailcowObjects": {key: stats[key] for key in ["domains", "mailboxes", "aliases", "filters"]}
+    }
+
+def _configureEnvironment(apiUri, workers, shard, asyncEngine):
+    environment = {
+        "LINUXMUSTER_MAILCOW_LDAP_URI": "ldap://benchmark.invalid",
+        "LINUXMUSTER_MAILCOW_LDAP_BASE_DN": "DC=linuxmuster,DC=lan",
+        "LINUXMUSTER_MAILCOW_LDAP_BIND_DN": "CN=benchmark,DC=linuxmuster,DC=lan",
+        "LINUXMUSTER_MAILCOW_LDAP_BIND_DN_PASSWORD": "benchmark",
+        "LINUXMUSTER_MAILCOW_API_KEY": "benchmark",
+        "LINUXMUSTER_MAILCOW_API_URI": apiUri,
+        "LINUXMUSTER_MAILCOW_SYNC_INTERVAL": "300",
+        "LINUXMUSTER_MAILCOW_DOMAIN_QUOTA": "10000000",
+        "LINUXMUSTER_MAILCOW_ENABLE_GAL": "1",
+        "LINUXMUSTER_MAILCOW_API_WORKERS": str(workers),
+        "LINUXMUSTER_MAILCOW_LDAP_INCREMENTAL": "0",
+        "LINUXMUSTER_MAILCOW_STATE_FILE": "",
+        "LINUXMUSTER_MAILCOW_METRICS_PORT": "0",
+        "LINUXMUSTER_MAILCOW_SHARD_BY_DOMAIN": "1" if shard else "0",
+        "LINUXMUSTER_MAILCOW_ASYNC_ENGINE": "1" if asyncEngine else "0"
+    }
+    os.environ.update(environment)
+
+def _getStats(apiUri):
+    with urllib.request.urlopen(f"{apiUri}/benchmark/stats") as response:
+        return json.loads(response.read())
+
+def _waitForServer(apiUri, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _getStats(apiUri)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def _printResults(results):
+    for result in results:
+        print(f"=== {result['scenario']}: {'OK' if result['success'] else 'FAILED'} in {result['duration']:.2f}s ===")
+        steps = ", ".join(f"{step} {duration:.2f}s" for step, duration in result["steps"].items() if duration != None)
+        print(f"    * steps: {steps}")
+        print(f"    * mailcow requests: {sum(result['mailcowRequests'].values())} {result['mailcowRequests']}")
+        print(f"    * ldap searches: {result['ldapSearches']}")
+        if result["peakMemoryMiB"] != None:
+            print(f"    * peak memory: {result['peakMemoryMiB']:.1f} MiB")
+        print(f"    * mailcow objects: {result['mailcowObjects']}")
+
+if __name__ == '__main__':
+    main()
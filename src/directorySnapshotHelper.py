@@ -0,0 +1,125 @@
+import logging, time
+
+from ldapHelper import LdapException
+
+class DirectorySnapshot:
+    """
+    Cached copy of the users and groups in AD which is kept up-to-date incrementally.
+
+    Only entries with a uSNChanged above the highestCommittedUSN of the last cycle are requested.
+    Deleted entries are not visible this way, so a full resync is done every fullSyncInterval seconds
+    and whenever the connected DC changes (USNs are local to one DC).
+    """
+
+    def __init__(self, ldapHelper, userFilter, userAttributes, userRoles, groupAttributes, listTypes, fullSyncInterval):
+        self._ldap = ldapHelper
+        self._userFilter = userFilter
+        self._userAttributes = list(set(userAttributes + ["distinguishedName", "sophomorixRole"]))
+        self._userRoles = userRoles
+        self._groupAttributes = list(set(groupAttributes + ["distinguishedName", "sophomorixType"]))
+        self._listTypes = listTypes
+        self._fullSyncInterval = int(fullSyncInterval)
+
+        self._users = {}
+        self._groups = {}
+        self._serviceName = None
+        self._highestCommittedUsn = None
+        self._lastFullSync = 0
+
+    def refresh(self):
+        """
+        Brings the snapshot up-to-date, either incrementally or with a full resync
+        :returns: True on success, False on error
+        """
+        ret, serviceName, highestCommittedUsn = self._ldap.getDirectoryState()
+        if not ret:
+            return False
+
+        try:
+            if self._needsFullSync(serviceName):
+                self._fullSync()
+            elif highestCommittedUsn == self._highestCommittedUsn:
+                logging.info(f"    * AD is unchanged since USN {highestCommittedUsn}")
+            else:
+                self._incrementalSync()
+        except LdapException:
+            # we cannot tell what was merged already, so start over next time
+            self._highestCommittedUsn = None
+            return False
+
+        # The USN is read before searching, changes made during the search will just be seen again next time
+        self._serviceName = serviceName
+        self._highestCommittedUsn = highestCommittedUsn
+        return True
+
+    def getUsers(self):
+        return list(self._users.values())
+
+    def getGroups(self):
+        return list(self._groups.values())
+
+    def getLists(self):
+        return [group for group in self._groups.values() if group.get("sophomorixType") in self._listTypes]
+
+    def _needsFullSync(self, serviceName):
+        return self._highestCommittedUsn == None \
+            or serviceName != self._serviceName \
+            or time.time() - self._lastFullSync >= self._fullSyncInterval
+
+    def _fullSync(self):
+        logging.info("    * Doing a full resync of users and groups from AD")
+        users = {}
+        for user in self._ldap.searchPaged(self._userFilter, self._userAttributes):
+            users[self._getDn(user)] = user
+
+        groups = {}
+        for group in self._ldap.searchPaged("(objectClass=group)", self._groupAttributes):
+            groups[self._getDn(group)] = group
+
+        self._users = users
+        self._groups = groups
+        self._lastFullSync = time.time()
+        logging.info(f"    * Loaded {len(self._users)} users and {len(self._groups)} groups")
+
+    def _incrementalSync(self):
+        usnFilter = f"(uSNChanged>={self._highestCommittedUsn + 1})"
+        logging.info(f"    * Loading users and groups changed since USN {self._highestCommittedUsn}")
+
+        # The role filter is checked locally, so users which do not match it anymore can be dropped
+        changedUsers = 0
+        for user in self._ldap.searchPaged(f"(&(objectClass=user){usnFilter})", self._userAttributes):
+            changedUsers += 1
+            if user.get("sophomorixRole") in self._userRoles:
+                self._users[self._getDn(user)] = user
+            else:
+                self._users.pop(self._getDn(user), None)
+
+        changedGroups = 0
+        for group in self._ldap.searchPaged(f"(&(objectClass=group){usnFilter})", self._groupAttributes):
+            changedGroups += 1
+            self._groups[self._getDn(group)] = group
+
+        logging.info(f"    * Merged {changedUsers} changed users and {changedGroups} changed groups")
+
+        # memberOf is a backlink, changing a group does not touch the uSNChanged of its members,
+        # neither of users nor of groups nested into it
+        if changedGroups > 0:
+            self._refreshMemberships()
+
+    def _refreshMemberships(self):
+        logging.info("    * Refreshing group memberships of users and groups")
+        self._refreshMembershipsOf(self._users, self._userFilter)
+        self._refreshMembershipsOf(self._groups, "(objectClass=group)")
+
+    def _refreshMembershipsOf(self, entries, filter):
+        for entry in self._ldap.searchPaged(filter, ["distinguishedName", "memberOf"]):
+            cachedEntry = entries.get(self._getDn(entry))
+            if cachedEntry == None:
+                continue
+            if "memberOf" in entry:
+                cachedEntry["memberOf"] = entry["memberOf"]
+            else:
+                cachedEntry.pop("memberOf", None)
+
+    def _getDn(self, entry):
+        return entry["distinguishedName"].lower()
@@ -1,54 +1,74 @@
-import random, string, sys, logging, requests, urllib3
+import random, string, sys, logging, time, json, asyncio, requests, urllib3, aiohttp
 
 class DockerapiHelper:
-    def __init__(self, host):
+    def __init__(self, host, cacheTtl=2, timeout=30):
+        """
+        :param timeout: timeout in seconds of every request, so a hanging dockerapi cannot block the sync
+        """
         self._host = host
+        self._cacheTtl = cacheTtl
+        self._timeout = float(timeout)
+        self._containerCache = None
+        self._containerCacheTime = 0
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-    def waitForContainersToBeRunning(self, containersToCkeck):
+    def waitForContainersToBeRunning(self, containersToCkeck, timeout=300, initialDelay=0.5, maxDelay=10):
+        """
+        Polls dockerapi with exponential backoff until all containers are running (and healthy, if they have a healthcheck).
+        mailcow's dockerapi does not offer an event stream, so polling is the only option.
+        :returns: True if all containers are running, False if the timeout was reached
+        """
         logging.info("Waiting for containers to be fully running:")
         for container in containersToCkeck:
             logging.info(f"    * {container}")
+
+        deadline = time.monotonic() + timeout
+        delay = initialDelay
         while True:
-            containers = self.getAllContainers()
-            containersChecked = 0
-            allContainersRunning = True
-            for id, container in containers.items():
-                try:
-                    thisContainerName = container["Config"]["Labels"]["com.docker.compose.service"]
-                except KeyError:
-                    continue
-                if thisContainerName in containersToCkeck:
-                    allContainersRunning = allContainersRunning and container["State"]["Running"]
-                    containersChecked += 1
-            
-            if containersChecked == len(containersToCkeck) and allContainersRunning:
+            try:
+                containers = self.getAllContainers(useCache=False)
+            except requests.exceptions.RequestException as e:
+                logging.debug(f"Could not reach dockerapi: {e}")
+                containers = None
+
+            if containers != None and _checkContainersReady(containers, containersToCkeck):
                 break
-        
+
+            if time.monotonic() + delay > deadline:
+                logging.warning(f"Containers were not running after {timeout} seconds")
+                return False
+
+            time.sleep(delay)
+            delay = min(delay * 2, maxDelay)
+
         logging.info("All containers running")
+        return True
+
+    def getAllContainers(self, useCache=True):
+        """
+        :param useCache: if True, a listing which is not older than cacheTtl seconds is reused
+        """
+        if useCache and self._containerCache != None and time.monotonic() - self._containerCacheTime < self._cacheTtl:
+            return self._containerCache
 
-    def getAllContainers(self):
         status, containers = self._getRequest("json")
         if status == 200:
+            self._containerCache = containers
+            self._containerCacheTime = time.monotonic()
             return containers
         return None
 
     def getContainerId(self, containerName):
         container = self.getContainerByName(containerName)
-        if "Id" in container:
+        if container and "Id" in container:
             return container["Id"]
         return None
 
     def getContainerByName(self, containerName):
         containers = self.getAllContainers()
-        for id, container in containers.items():
-            try:
-                thisContainerName = container["Config"]["Labels"]["com.docker.compose.service"]
-            except KeyError:
-                continue
-            if thisContainerName == containerName:
-                return container
-        return None
+        if containers == None:
+            return None
+        return _findContainer(containers, containerName)
 
     def restartContainer(self, containerName):
         logging.info(f"Restarting container {containerName} ... ")
@@ -58,16 +78,13 @@ class DockerapiHelper:
             logging.error("ERROR getting container details")
             return False
 
-        if container["State"]["Running"]:
-            status, data = self._postRequest(f"{container['Id']}/restart")
-        elif container["State"]["Paused"] or container ["State"]["Dead"]:
-            status, data = self._postRequest(f"{container['Id']}/start")
-        elif container["State"]["Restarting"]:
-            logging.info("already restarting.")
-            return True
-        else:
-            logging.error("not restartable")
-            return False
+        action = _getRestartAction(container)
+        if action == None:
+            return container["State"]["Restarting"]
+        status, data = self._postRequest(f"{container['Id']}/{action}")
+
+        # the state of the container has changed
+        self._containerCache = None
 
         if status == 200:
             return True
@@ -75,11 +92,29 @@ class DockerapiHelper:
             logging.error(f"ERROR: {status}")
             return False
 
-    def _postRequest(self, url):
+    def reloadContainer(self, containerName, task):
+        """
+        Lets a running container reload its config with mailcow's exec command instead of restarting it
+        :param task: the reload task of mailcow's dockerapi, e.g. "dovecot"
+        """
+        logging.info(f"Reloading container {containerName} ... ")
+        container = self.getContainerByName(containerName)
+
+        if not container or not container["State"]["Running"]:
+            logging.error("ERROR container is not running")
+            return False
+
+        status, data = self._postRequest(f"{container['Id']}/exec", {"cmd": "reload", "task": task})
+        return _checkReloadResult(status, data)
+
+    def _postRequest(self, url, jsonData=None):
         api_url = f"{self._host}/containers/{url}"
-        headers = {'Content-type': 'text/html; charset=utf-8'}
 
-        req = requests.post(api_url, headers=headers, verify=False)
+        if jsonData == None:
+            headers = {'Content-type': 'text/html; charset=utf-8'}
+            req = requests.post(api_url, headers=headers, verify=False, timeout=self._timeout)
+        else:
+            req = requests.post(api_url, json=jsonData, verify=False, timeout=self._timeout)
         req.close()
 
         return req.status_code, req.text
@@ -87,7 +122,194 @@ class DockerapiHelper:
     def _getRequest(self, url):
         requestUrl = f"{self._host}/containers/{url}"
         headers = {'Content-type': 'text/html; charset=utf-8'}
-        req = requests.get(requestUrl, headers=headers, verify=False)
+        req = requests.get(requestUrl, headers=headers, verify=False, timeout=self._timeout)
         req.close()
         
-        return req.status_code, req.json()
\ No newline at end of file
+        return req.status_code, req.json()
+
+class AsyncDockerapiHelper:
+    """
+    asyncio implementation of the DockerapiHelper operations, used by the async engine
+    """
+
+    def __init__(self, host, cacheTtl=2, timeout=30):
+        self._host = host
+        self._cacheTtl = cacheTtl
+        self._timeout = float(timeout)
+        self._containerCache = None
+        self._containerCacheTime = 0
+        # the session has to be created in the event loop
+        self._session = None
+
+    async def close(self):
+        if self._session != None:
+            await self._session.close()
+
+    async def waitForContainersToBeRunning(self, containersToCkeck, timeout=300, initialDelay=0.5, maxDelay=10):
+        """
+        See DockerapiHelper.waitForContainersToBeRunning()
+        """
+        logging.info("Waiting for containers to be fully running:")
+        for container in containersToCkeck:
+            logging.info(f"    * {container}")
+
+        deadline = time.monotonic() + timeout
+        delay = initialDelay
+        while True:
+            try:
+                containers = await self.getAllContainers(useCache=False)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.debug(f"Could not reach dockerapi: {e!r}")
+                containers = None
+
+            if containers != None and _checkContainersReady(containers, containersToCkeck):
+                break
+
+            if time.monotonic() + delay > deadline:
+                logging.warning(f"Containers were not running after {timeout} seconds")
+                return False
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, maxDelay)
+
+        logging.info("All containers running")
+        return True
+
+    async def getAllContainers(self, useCache=True):
+        if useCache and self._containerCache != None and time.monotonic() - self._containerCacheTime < self._cacheTtl:
+            return self._containerCache
+
+        status, containers = await self._getRequest("json")
+        if status == 200:
+            self._containerCache = containers
+            self._containerCacheTime = time.monotonic()
+            return self._containerCache
+        return None
+
+    async def getContainerByName(self, containerName):
+        containers = await self.getAllContainers()
+        if containers == None:
+            return None
+        return _findContainer(containers, containerName)
+
+    async def restartContainer(self, containerName):
+        logging.info(f"Restarting container {containerName} ... ")
+        container = await self.getContainerByName(containerName)
+
+        if not container:
+            logging.error("ERROR getting container details")
+            return False
+
+        action = _getRestartAction(container)
+        if action == None:
+            return container["State"]["Restarting"]
+        status, data = await self._postRequest(f"{container['Id']}/{action}")
+
+        # the state of the container has changed
+        self._containerCache = None
+
+        if status == 200:
+            return True
+        else:
+            logging.error(f"ERROR: {status}")
+            return False
+
+    async def reloadContainer(self, containerName, task):
+        """
+        See DockerapiHelper.reloadContainer()
+        """
+        logging.info(f"Reloading container {containerName} ... ")
+        container = await self.getContainerByName(containerName)
+
+        if not container or not container["State"]["Running"]:
+            logging.error("ERROR container is not running")
+            return False
+
+        status, data = await self._postRequest(f"{container['Id']}/exec", {"cmd": "reload", "task": task})
+        return _checkReloadResult(status, data)
+
+    async def _postRequest(self, url, jsonData=None):
+        api_url = f"{self._host}/containers/{url}"
+
+        if jsonData == None:
+            headers = {'Content-type': 'text/html; charset=utf-8'}
+            request = self._getSession().post(api_url, headers=headers)
+        else:
+            request = self._getSession().post(api_url, json=jsonData)
+        async with request as response:
+            return response.status, await response.text()
+
+    async def _getRequest(self, url):
+        requestUrl = f"{self._host}/containers/{url}"
+        headers = {'Content-type': 'text/html; charset=utf-8'}
+        async with self._getSession().get(requestUrl, headers=headers) as response:
+            return response.status, json.loads(await response.read())
+
+    def _getSession(self):
+        if self._session == None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(ssl=False),
+                timeout=aiohttp.ClientTimeout(total=self._timeout)
+            )
+        return self._session
+
+def _findContainer(containers, containerName):
+    for id, container in containers.items():
+        try:
+            thisContainerName = container["Config"]["Labels"]["com.docker.compose.service"]
+        except KeyError:
+            continue
+        if thisContainerName == containerName:
+            return container
+    return None
+
+def _getRestartAction(container):
+    """
+    :returns: "restart" or "start" depending on the state of the container, None if it is restarting already or not restartable
+    """
+    if container["State"]["Running"]:
+        return "restart"
+    elif container["State"]["Paused"] or container ["State"]["Dead"]:
+        return "start"
+    elif container["State"]["Restarting"]:
+        logging.info("already restarting.")
+    else:
+        logging.error("not restartable")
+    return None
+
+def _checkReloadResult(status, data):
+    if status != 200:
+        logging.error(f"ERROR: {status}")
+        return False
+
+    try:
+        response = json.loads(data)
+    except ValueError:
+        response = None
+    if not isinstance(response, dict) or response.get("type") != "success":
+        logging.error(f"ERROR: {data}")
+        return False
+
+    return True
+
+def _checkContainersReady(containers, containersToCkeck):
+    containersChecked = 0
+    allContainersRunning = True
+    for id, container in containers.items():
+        try:
+            thisContainerName = container["Config"]["Labels"]["com.docker.compose.service"]
+        except KeyError:
+            continue
+        if thisContainerName in containersToCkeck:
+            allContainersRunning = allContainersRunning and _checkContainerReady(container)
+            containersChecked += 1
+
+    return containersChecked == len(containersToCkeck) and allContainersRunning
+
+def _checkContainerReady(container):
+    state = container["State"]
+    if not state["Running"]:
+        return False
+    if "Health" in state and state["Health"]:
+        return state["Health"]["Status"] == "healthy"
+    return True
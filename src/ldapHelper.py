@@ -1,72 +1,288 @@
-import ldap, logging
+import ldap, logging, time, metricsHelper
+
+from ldap.controls import SimplePagedResultsControl
+
+class LdapException(Exception):
+    pass
+
+class LdapAttribute:
+    """
+    Describes how the values of an attribute are decoded:
+    - single-valued attributes become one value (or None if missing), multi-valued ones always a list
+    - valueType converts the raw bytes: str, int or bool (LDAP booleans are "TRUE" or "FALSE")
+    - skipped attributes are never decoded (e.g. binary attributes)
+    """
+    __slots__ = ("multiValued", "valueType", "skip")
+
+    def __init__(self, multiValued=False, valueType=str, skip=False):
+        self.multiValued = multiValued
+        self.valueType = valueType
+        self.skip = skip
+
+class LdapAttributeDecoder:
+    """
+    Decodes raw search results into dicts of consistently shaped and typed values using a schema.
+    The converter of every attribute is looked up once per search, not once per entry and attribute.
+    Attributes which are not in the schema are decoded like before: str for one value, list for multiple values.
+    """
+
+    def __init__(self, schema=None):
+        # attribute -> (attribute, converter, multiValued), None for skipped attributes
+        self._steps = {}
+        for attribute, definition in (schema or {}).items():
+            self._steps[attribute] = None if definition.skip else (attribute, _converters[definition.valueType], definition.multiValued)
+
+    def decode(self, rawResult, attrlist=None):
+        # without attrlist, all returned attributes were requested
+        return self._decodeEntry(rawResult, self._getSteps(attrlist if attrlist != None else rawResult))
+
+    def getDecoder(self, attrlist):
+        """
+        :returns: a function which decodes one raw result with the given attributes, should be reused for all results of a search
+        """
+        steps = self._getSteps(attrlist)
+        return lambda rawResult: self._decodeEntry(rawResult, steps)
+
+    def _getSteps(self, attributes):
+        """
+        :returns: list of (attribute, converter, multiValued), converter is None for attributes which are not in the schema
+        """
+        steps = []
+        for attribute in attributes:
+            if attribute not in self._steps:
+                steps.append((attribute, None, False))
+            elif self._steps[attribute] != None:
+                steps.append(self._steps[attribute])
+        return steps
+
+    def _decodeEntry(self, rawResult, steps):
+        """
+        Values which cannot be decoded are dropped, attributes in the schema keep their shape:
+        multi-valued ones keep their valid values, single-valued ones become None.
+        """
+        result = {}
+        get = rawResult.get
+        for attribute, convert, multiValued in steps:
+            values = get(attribute)
+            try:
+                if convert == None:
+                    if values:
+                        result[attribute] = values[0].decode() if len(values) == 1 else [value.decode() for value in values]
+                elif multiValued:
+                    result[attribute] = [convert(value) for value in values] if values else []
+                else:
+                    result[attribute] = convert(values[0]) if values else None
+            except (UnicodeDecodeError, ValueError):
+                if convert == None:
+                    continue
+                elif multiValued:
+                    result[attribute] = _convertValid(convert, values)
+                else:
+                    result[attribute] = None
+        return result
+
+def _convertValid(convert, values):
+    validValues = []
+    for value in values:
+        try:
+            validValues.append(convert(value))
+        except (UnicodeDecodeError, ValueError):
+            continue
+    return validValues
+
+# functions which convert one raw value
+_converters = {
+    str: bytes.decode,
+    int: int,
+    # LDAP booleans are "TRUE" or "FALSE"
+    bool: lambda value: value.upper() == b"TRUE"
+}
 
 class LdapHelper:
-    def __init__(self, ldapUri, ldapBindDn, ldapBindPassword, ldapBaseDn):
-        self._uri = ldapUri
+    """
+    Keeps one authenticated connection to the AD across sync cycles.
+    Before it is used, bind() checks if it is still alive and otherwise reconnects,
+    trying the primary and all failover URIs with backoff.
+    """
+
+    def __init__(self, ldapUri, ldapBindDn, ldapBindPassword, ldapBaseDn, pageSize=500, failoverUris="", startTls=False, timeout=10, connectRetries=2, attributeSchema=None):
+        """
+        :param attributeSchema: dict of attribute name -> LdapAttribute, used to decode search results
+        """
+        self._uris = [ldapUri] + failoverUris.replace(",", " ").split()
         self._bindDn = ldapBindDn
         self._bindPassword = ldapBindPassword
         self._baseDn = ldapBaseDn
+        self._pageSize = int(pageSize)
+        self._startTls = startTls
+        self._timeout = float(timeout)
+        self._connectRetries = int(connectRetries)
+        self._ldapConnection = None
+        self._connectedUri = None
+        self._decoder = LdapAttributeDecoder(attributeSchema)
 
     def bind(self):
-        try:
-            self._ldapConnection = ldap.initialize(f"{self._uri}")
-            self._ldapConnection.set_option(ldap.OPT_REFERRALS, 0)
-            self._ldapConnection.simple_bind_s(self._bindDn, self._bindPassword)
-            return True
-        except Exception as e:
-            logging.critical("!!! Error binding to ldap! {} !!!".format(e))
-            return False
+        """
+        Makes sure there is an authenticated connection, an existing one is reused if it is still alive
+        :returns: True if connected
+        """
+        if self._ldapConnection != None:
+            if self._isAlive():
+                return True
+            logging.warning(f"The connection to {self._connectedUri} was lost, reconnecting")
+            self.unbind()
+
+        delay = 1
+        for attempt in range(self._connectRetries + 1):
+            if attempt > 0:
+                logging.info(f"Retrying to connect to ldap in {delay} seconds")
+                time.sleep(delay)
+                delay *= 2
+
+            for uri in self._getUrisInOrder():
+                if self._connect(uri):
+                    return True
+
+        logging.critical("!!! Error binding to ldap, no server could be reached !!!")
+        return False
 
     def unbind(self):
+        """
+        Closes the connection, the next bind() opens a new one
+        """
         if self._ldapConnection != None:
-            self._ldapConnection.unbind_s()
+            try:
+                self._ldapConnection.unbind_s()
+            except ldap.LDAPError:
+                pass
             self._ldapConnection = None
 
-    def search(self, filter, attrlist=None):
+    def getDirectoryState(self):
+        """
+        Reads the identity and the highestCommittedUSN of the connected DC from the rootDSE.
+        USNs are local to one DC, so both are needed to decide if an incremental search is possible.
+        :returns: success, dsServiceName, highestCommittedUSN
+        """
         if self._ldapConnection == None:
             logging.critical("Cannot talk to LDAP")
-            return False, None
+            return False, None, None
 
         try:
-            rawResults = self._ldapConnection.search_s(
-                    self._baseDn,
-                    ldap.SCOPE_SUBTREE,
-                    filter,
-                    attrlist
-                    )
+            rawResults = self._ldapConnection.search_s("", ldap.SCOPE_BASE, "(objectClass=*)", ["dsServiceName", "highestCommittedUSN"])
+            rootDse = self._decoder.decode(rawResults[0][1])
+            return True, rootDse["dsServiceName"], int(rootDse["highestCommittedUSN"])
         except Exception as e:
-            logging.critical("Error executing LDAP search!")
+            logging.critical("Error reading the rootDSE!")
             print(e)
-            return False, None
+            return False, None, None
 
+    def search(self, filter, attrlist=None):
         try:
-            processedResults =  []
+            processedResults = list(self.searchPaged(filter, attrlist))
+        except LdapException:
+            return False, None
+
+        if len(processedResults) <= 0:
+            return False, None
+
+        return True, processedResults
+
+    def searchPaged(self, filter, attrlist=None, pageSize=None):
+        """
+        Generator which yields the decoded results page by page using the Simple Paged Results control,
+        so only one page has to be held in memory at a time and the server size limit does not apply.
+        :raises LdapException: if the search failed
+        """
+        if self._ldapConnection == None:
+            logging.critical("Cannot talk to LDAP")
+            raise LdapException("Not bound")
+
+        pageSize = self._pageSize if pageSize == None else int(pageSize)
+        decode = self._decoder.getDecoder(attrlist) if attrlist != None else self._decoder.decode
+        pageControl = SimplePagedResultsControl(True, size=pageSize, cookie='')
 
-            if len(rawResults) <= 0 or rawResults[0][0] == None:
-                return False, None
+        while True:
+            try:
+                with metricsHelper.ldapRequestDuration.time(operation="search"):
+                    messageId = self._ldapConnection.search_ext(
+                        self._baseDn,
+                        ldap.SCOPE_SUBTREE,
+                        filter,
+                        attrlist,
+                        serverctrls=[pageControl] if pageSize > 0 else None
+                        )
+                    _, rawResults, _, serverControls = self._ldapConnection.result3(messageId)
+            except Exception as e:
+                metricsHelper.ldapRequestFailures.inc(operation="search")
+                logging.critical("Error executing LDAP search!")
+                print(e)
+                if isinstance(e, (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR)):
+                    # the next bind() connects again
+                    self.unbind()
+                raise LdapException(e)
 
             for dn, rawResult in rawResults:
+                # referrals have no dn
                 if not dn:
                     continue
+                yield decode(rawResult)
 
-                processedResult = {}
-                
-                for attribute, rawValue in rawResult.items():
-                    try:
-                        if len(rawValue) == 1:
-                            processedResult[attribute] = str(rawValue[0].decode())
-                        elif len(rawValue) > 0:
-                            processedResult[attribute] = []
-                            for rawItem in rawValue:
-                                processedResult[attribute].append(str(rawItem.decode()))
+            cookie = None
+            for serverControl in serverControls or []:
+                if serverControl.controlType == SimplePagedResultsControl.controlType:
+                    cookie = serverControl.cookie
 
-                    except UnicodeDecodeError:
-                        continue
-
-                processedResults.append(processedResult)
-                    
-            return True, processedResults
+            if not cookie:
+                break
+            pageControl.cookie = cookie
 
+    def _connect(self, uri):
+        connection = None
+        try:
+            with metricsHelper.ldapRequestDuration.time(operation="bind"):
+                connection = ldap.initialize(uri)
+                connection.set_option(ldap.OPT_REFERRALS, 0)
+                connection.set_option(ldap.OPT_PROTOCOL_VERSION, ldap.VERSION3)
+                connection.set_option(ldap.OPT_NETWORK_TIMEOUT, self._timeout)
+                connection.set_option(ldap.OPT_TIMEOUT, self._timeout)
+                if self._startTls and uri.lower().startswith("ldap://"):
+                    # no TLS options are set per connection, so the global TLS context and its session cache are used
+                    connection.start_tls_s()
+                connection.simple_bind_s(self._bindDn, self._bindPassword)
         except Exception as e:
-            print(e)
-            return False, None
+            metricsHelper.ldapRequestFailures.inc(operation="bind")
+            logging.error(f"Error binding to {uri}: {e}")
+            if connection != None:
+                # close the socket of the half-open connection right away
+                try:
+                    connection.unbind_s()
+                except ldap.LDAPError:
+                    pass
+            return False
+
+        if self._connectedUri != None and self._connectedUri != uri:
+            logging.warning(f"Failed over from {self._connectedUri} to {uri}")
+        logging.info(f"    * Connected to {uri}")
+        self._ldapConnection = connection
+        self._connectedUri = uri
+        return True
+
+    def _isAlive(self):
+        """
+        Cheap liveness check with the "Who am I?" extended operation
+        """
+        try:
+            with metricsHelper.ldapRequestDuration.time(operation="whoami"):
+                self._ldapConnection.whoami_s()
+            return True
+        except ldap.LDAPError as e:
+            logging.debug(f"Liveness check of {self._connectedUri} failed: {e}")
+            return False
+
+    def _getUrisInOrder(self):
+        """
+        :returns: all URIs, the last working one first
+        """
+        if self._connectedUri in self._uris:
+            return [self._connectedUri] + [uri for uri in self._uris if uri != self._connectedUri]
+        return self._uris
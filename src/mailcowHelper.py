@@ -1,15 +1,53 @@
-import random, string, sys, logging
-import requests, urllib3
+import random, string, sys, logging, time, json, codecs, threading, contextlib, concurrent.futures, asyncio
+import requests, urllib3, aiohttp, metricsHelper
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 class MailcowException(Exception):
     pass
 
 class MailcowHelper:
-    def __init__(self, host, apiKey):
+    # Adding a domain restarts SOGo, so domains are never processed concurrently, also not by different instances
+    typeWorkerLimits = {"domain": 1}
+    typeLocks = {"domain": threading.Lock()}
+
+    def __init__(self, host, apiKey, poolSize=10, timeout=60, retries=3, workers=1, rateController=None):
+        """
+        :param rateController: optional RateController which limits the concurrency of POST requests
+        """
         self._host = host
         self._apiKey = apiKey
+        self._timeout = float(timeout)
+        self._workers = int(workers)
+        self._rateController = rateController
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+        self._session = self._createSession(int(poolSize), int(retries))
+
+    def getConnectionStats(self):
+        """
+        :returns: dict with the number of requests sent, connections opened and requests which reused a connection
+        """
+        requestCount = 0
+        connectionCount = 0
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requestCount += pool.num_requests
+                connectionCount += pool.num_connections
+
+        return {
+            "requests": requestCount,
+            "connections": connectionCount,
+            "reused": max(requestCount - connectionCount, 0)
+        }
+
+    def close(self):
+        self._session.close()
+
     def addElementsOfType(self, elementType, elements):
         self._processElementList(elementType, elements, "api/v1/add", True, "adding")
 
@@ -19,27 +57,116 @@ class MailcowHelper:
     def updateElementsOfType(self, elementType, elements):
         self._processElementList(elementType, elements, "api/v1/edit", True, "updating")
 
+    def processDependentElements(self, tasks):
+        """
+        Sends one request per task as soon as all tasks it depends on succeeded, up to workers at once.
+        Tasks which depend on a failed task are skipped.
+        :param tasks: list of (task key, element type, "add" or "update", payload, list of task keys it depends on),
+                      dependencies on keys which are not in tasks are ignored
+        :raises MailcowException: after all possible tasks were processed, if any task failed or was skipped
+        """
+        if len(tasks) <= 0:
+            return
+
+        apiPaths = {"add": "api/v1/add", "update": "api/v1/edit"}
+        taskKeys = set(task[0] for task in tasks)
+        tasksByKey = {}
+        waitingFor = {}
+        dependents = {}
+        for taskKey, elementType, action, payload, dependencies in tasks:
+            tasksByKey[taskKey] = (elementType, action, payload)
+            dependencies = set(dependency for dependency in dependencies if dependency in taskKeys and dependency != taskKey)
+            waitingFor[taskKey] = len(dependencies)
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(taskKey)
+
+        logging.info(f"    * processing {len(tasks)} requests in order of their dependencies")
+        startTime = time.monotonic()
+
+        def processTask(taskKey):
+            elementType, action, payload = tasksByKey[taskKey]
+            logging.debug(f"        * {action} {elementType} {taskKey}")
+            with self.typeLocks.get(elementType, contextlib.nullcontext()):
+                return self._postRequest(f"{apiPaths[action]}/{elementType}", payload)
+
+        failures = []
+        skipped = []
+        with ThreadPoolExecutor(max_workers=max(self._workers, 1)) as executor:
+            running = {executor.submit(processTask, taskKey): taskKey for taskKey, count in waitingFor.items() if count == 0}
+            while len(running) > 0:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    taskKey = running.pop(future)
+                    res, errorMessage = future.result()
+                    if not res:
+                        elementType, action, payload = tasksByKey[taskKey]
+                        logging.critical(f"!!! Error while processing {action} of {elementType}: {payload}")
+                        logging.critical(f"!!! Error message from server: \"{self._getErrorMessage(errorMessage)}\"!!!")
+                        failures.append(errorMessage)
+                        skipped += self._getAllDependents(taskKey, dependents)
+                        continue
+
+                    for dependent in dependents.get(taskKey, []):
+                        waitingFor[dependent] -= 1
+                        if waitingFor[dependent] == 0:
+                            running[executor.submit(processTask, dependent)] = dependent
+
+        duration = time.monotonic() - startTime
+        skipped = set(skipped)
+        logging.info(f"        * {len(tasks) - len(failures) - len(skipped)} succeeded, {len(failures)} failed, {len(skipped)} skipped in {duration:.1f}s ({len(tasks) / max(duration, 0.001):.1f} requests/s)")
+
+        if len(failures) > 0:
+            raise MailcowException(failures[0])
+
+    def _getAllDependents(self, taskKey, dependents):
+        allDependents = []
+        stack = list(dependents.get(taskKey, []))
+        while len(stack) > 0:
+            dependent = stack.pop()
+            if dependent not in allDependents:
+                allDependents.append(dependent)
+                stack += dependents.get(dependent, [])
+        return allDependents
+
     def _processElementList(self, elementType, elements, apiPath, processOneByOne, actionString):
+        """
+        Sends the elements to mailcow, one request per element if processOneByOne is set.
+        Requests are sent concurrently by up to workers threads. Errors are collected and
+        a MailcowException is raised after all elements were processed.
+        """
         elementCount = len(elements)
         if elementCount <= 0:
             return
 
         logging.info(f"    * {actionString} {len(elements)} {elementType}s")
 
-        if not processOneByOne:
-            elementCount = 1
+        payloads = elements if processOneByOne else [elements]
+        workers = min(self.typeWorkerLimits.get(elementType, self._workers), len(payloads))
+        startTime = time.monotonic()
 
-        for i in range(elementCount):
-            if processOneByOne:
-                logging.info(f"        * {actionString} {elementType} {i+1}/{elementCount}")
-                res, errorMessage = self._postRequest(f"{apiPath}/{elementType}", elements[i])
+        def processPayload(i):
+            logging.debug(f"        * {actionString} {elementType} {i+1}/{len(payloads)}")
+            return self._postRequest(f"{apiPath}/{elementType}", payloads[i])
+
+        with self.typeLocks.get(elementType, contextlib.nullcontext()):
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(processPayload, range(len(payloads))))
             else:
-                res, errorMessage = self._postRequest(f"{apiPath}/{elementType}", elements)
+                results = list(map(processPayload, range(len(payloads))))
 
+        failures = []
+        for payload, (res, errorMessage) in zip(payloads, results):
             if not res:
-                logging.critical(f"!!! Error while {actionString} {elementType}: {elements[i]}")
+                logging.critical(f"!!! Error while {actionString} {elementType}: {payload}")
                 logging.critical(f"!!! Error message from server: \"{self._getErrorMessage(errorMessage)}\"!!!")
-                raise MailcowException(errorMessage)
+                failures.append(errorMessage)
+
+        duration = time.monotonic() - startTime
+        logging.info(f"        * {len(payloads) - len(failures)} succeeded, {len(failures)} failed in {duration:.1f}s ({len(payloads) / max(duration, 0.001):.1f} requests/s)")
+
+        if len(failures) > 0:
+            raise MailcowException(failures[0])
 
     def getAllElementsOfType(self, elementType):
         logging.info(f"    * Loading current {elementType}s from Mailcow")
@@ -49,38 +176,153 @@ class MailcowHelper:
             raise MailcowException(res)
         return data
 
+    def iterateAllElementsOfType(self, elementType, chunkSize=65536):
+        """
+        Like getAllElementsOfType(), but the response is decoded while it is downloaded
+        and every element is yielded as soon as it is complete.
+        :raises MailcowException: if mailcow returned an error
+        """
+        logging.info(f"    * Streaming current {elementType}s from Mailcow")
+        requestUrl = f"{self._host}/api/v1/get/{elementType}/all"
+
+        logging.debug(f"Sending streaming GET to: {requestUrl}")
+
+        # only the time until the response starts is measured, the rest depends on how fast we consume it
+        with metricsHelper.mailcowRequestDuration.time(method="GET"):
+            req = self._session.get(requestUrl, timeout=self._timeout, stream=True)
+
+        with req:
+            if req.status_code != 200:
+                metricsHelper.mailcowRequestFailures.inc(method="GET")
+                try:
+                    rsp = req.json()
+                    data = rsp["msg"]
+                except:
+                    data = f"Got malformed response! Is {self._host} a mailcow server?"
+                logging.critical(f"!!! Error getting {elementType}s from Mailcow: {data} !!!")
+                raise MailcowException(req.status_code)
+
+            try:
+                yield from self._iterateJsonArray(req.iter_content(chunk_size=chunkSize))
+            except ValueError as e:
+                logging.critical(f"!!! Error decoding {elementType}s from Mailcow: {e} !!!")
+                raise MailcowException("Could not decode response, is mailcow still starting up?")
+
+    def _iterateJsonArray(self, chunks):
+        """
+        Incrementally decodes a JSON array from an iterable of byte chunks and yields its elements.
+        Mailcow returns an empty object instead of an empty array when there are no elements.
+        """
+        textDecoder = codecs.getincrementaldecoder("utf-8")()
+        jsonDecoder = json.JSONDecoder()
+        buffer = ""
+        arrayStarted = False
+
+        for chunk in chunks:
+            buffer += textDecoder.decode(chunk)
+            position = 0
+
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position >= len(buffer):
+                    break
+
+                if not arrayStarted:
+                    if buffer[position] == "[":
+                        arrayStarted = True
+                        position += 1
+                        continue
+                    elif buffer[position] == "{":
+                        # not an array, wait for the whole response
+                        break
+                    else:
+                        raise ValueError(f"Unexpected character {buffer[position]!r}")
+
+                if buffer[position] == "]":
+                    return
+
+                try:
+                    element, position = jsonDecoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the element is not complete yet
+                    break
+                yield element
+
+            buffer = buffer[position:]
+
+        buffer += textDecoder.decode(b"", final=True)
+        if arrayStarted:
+            raise ValueError("Response ended before the end of the array")
+
+        rsp = json.loads(buffer)
+        if isinstance(rsp, dict) and "type" in rsp and "msg" in rsp:
+            raise ValueError(rsp["msg"])
+        elif rsp:
+            raise ValueError("Expected an array")
+
+    def _createSession(self, poolSize, retries):
+        """
+        Creates a session with a keep-alive connection pool, so not every request has to do a new TCP and TLS handshake.
+        Connection errors are retried for all requests, server errors only for GET requests, as an add might have
+        been processed already.
+        """
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET"],
+            backoff_factor=0.5,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, max_retries=retry)
+
+        session = requests.Session()
+        session.headers.update({'X-API-Key': self._apiKey, 'Content-type': 'application/json'})
+        session.verify = False
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
     def _postRequest(self, url, json_data):
         api_url = f"{self._host}/{url}"
-        headers = {'X-API-Key': self._apiKey, 'Content-type': 'application/json'}
 
         logging.debug(f"Sending POST with JSON: {json_data}")
 
-        req = requests.post(api_url, headers=headers, json=json_data, verify=False)
+        if self._rateController:
+            self._rateController.acquire()
+
+        startTime = time.monotonic()
+        overloaded = True
+        try:
+            with metricsHelper.mailcowRequestDuration.time(method="POST"):
+                req = self._session.post(api_url, json=json_data, timeout=self._timeout)
+            overloaded = req.status_code >= 500
+        except requests.exceptions.RequestException as e:
+            metricsHelper.mailcowRequestFailures.inc(method="POST")
+            return False, str(e)
+        finally:
+            if self._rateController:
+                self._rateController.release(time.monotonic() - startTime, overloaded)
+
         try:
             rsp = req.json()
         except:
-            rsp = "Could not decode response, is mailcow still starting up?"
-            return 900, rsp
-        req.close()
+            return False, "Could not decode response, is mailcow still starting up?"
+        finally:
+            req.close()
 
-        if isinstance(rsp, list):
-            rsp = rsp[0]
-
-        if "type" in rsp and "msg" in rsp:
-            if rsp['type'] != 'success':
-                return False, rsp['msg']
-            else:
-                return True, None
-        else:
-            return False, f"Got malformed response! Is {self._host} a mailcow server?"
+        return _getPostResult(rsp, self._host)
 
     def _getRequest(self, url):
         requestUrl = f"{self._host}/{url}"
-        headers = {'X-API-Key': self._apiKey, 'Content-type': 'application/json'}
 
         logging.debug(f"Sending GET to: {requestUrl}")
 
-        req = requests.get(requestUrl, headers=headers, verify=False)
+        with metricsHelper.mailcowRequestDuration.time(method="GET"):
+            req = self._session.get(requestUrl, timeout=self._timeout)
         try:
             rsp = req.json()
         except:
@@ -90,6 +332,7 @@ class MailcowHelper:
         req.close()
 
         if req.status_code != 200:
+            metricsHelper.mailcowRequestFailures.inc(method="GET")
             if "type" in rsp and "msg" in rsp:
                 return req.status_code, rsp["msg"]
             else:
@@ -99,10 +342,265 @@ class MailcowHelper:
 
 
     def _getErrorMessage(self, error):
-        commonErrors = {
-            "mailbox_quota_left_exceeded": "The quota of the domain was exeeded, please choose a higher value for LINUXMUSTER_MAILCOW_DOMAIN_QUOTA"
+        return _getErrorMessage(error)
+
+class AsyncMailcowHelper:
+    """
+    asyncio implementation of the MailcowHelper operations, used by the async engine.
+    Every request is a coroutine on one event loop, so the number of requests in flight is only limited by
+    the concurrency (and the rate control), not by a number of threads.
+    """
+    retryStatusCodes = [502, 503, 504]
+
+    def __init__(self, host, apiKey, concurrency=100, timeout=60, retries=3, rateController=None):
+        """
+        :param concurrency: maximum number of requests in flight and of kept-alive connections
+        :param rateController: optional RateController which limits the concurrency of POST requests
+        """
+        self._host = host
+        self._apiKey = apiKey
+        self._concurrency = int(concurrency)
+        self._timeout = float(timeout)
+        self._retries = int(retries)
+        self._rateController = rateController
+        # see MailcowHelper.typeLocks, but only within this process
+        self._typeLocks = {elementType: asyncio.Lock() for elementType in MailcowHelper.typeLocks}
+        self._requestSlots = asyncio.Semaphore(self._concurrency)
+
+        # the session has to be created in the event loop
+        self._session = None
+        self._requestCount = 0
+        self._connectionCount = 0
+
+    def getConnectionStats(self):
+        """
+        :returns: dict with the number of requests sent, connections opened and requests which reused a connection
+        """
+        return {
+            "requests": self._requestCount,
+            "connections": self._connectionCount,
+            "reused": max(self._requestCount - self._connectionCount, 0)
         }
-        if error[0] in commonErrors:
-            return commonErrors[error[0]]
+
+    async def close(self):
+        if self._session != None:
+            await self._session.close()
+
+    async def addElementsOfType(self, elementType, elements):
+        await self._processElementList(elementType, elements, "api/v1/add", True, "adding")
+
+    async def killElementsOfType(self, elementType, elements):
+        await self._processElementList(elementType, elements, "api/v1/delete", False, "killing")
+
+    async def updateElementsOfType(self, elementType, elements):
+        await self._processElementList(elementType, elements, "api/v1/edit", True, "updating")
+
+    async def getAllElementsOfType(self, elementType):
+        """
+        GET requests are retried with backoff on connection errors and gateway errors, like in MailcowHelper
+        :raises MailcowException: if mailcow returned an error
+        """
+        logging.info(f"    * Loading current {elementType}s from Mailcow")
+        url = f"api/v1/get/{elementType}/all"
+        logging.debug(f"Sending GET to: {self._host}/{url}")
+
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                with metricsHelper.mailcowRequestDuration.time(method="GET"):
+                    status, data = await self._request("GET", url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or repr(e)
+                continue
+            if status in self.retryStatusCodes:
+                error = f"Status {status}"
+                continue
+            break
+        else:
+            metricsHelper.mailcowRequestFailures.inc(method="GET")
+            logging.critical(f"!!! Error getting {elementType}s from Mailcow: {error} !!!")
+            raise MailcowException(error)
+
+        if status != 200 or data == None or (isinstance(data, dict) and "type" in data and "msg" in data):
+            metricsHelper.mailcowRequestFailures.inc(method="GET")
+            message = data["msg"] if isinstance(data, dict) and "msg" in data else f"Got malformed response! Is {self._host} a mailcow server?"
+            logging.critical(f"!!! Error getting {elementType}s from Mailcow: {message} !!!")
+            raise MailcowException(status)
+
+        # mailcow returns an empty object instead of an empty array when there are no elements
+        return data if isinstance(data, list) else []
+
+    async def processDependentElements(self, tasks):
+        """
+        Like MailcowHelper.processDependentElements(), but every task is a coroutine which waits for the tasks it depends on
+        :raises MailcowException: after all possible tasks were processed, if any task failed or was skipped
+        """
+        if len(tasks) <= 0:
+            return
+
+        apiPaths = {"add": "api/v1/add", "update": "api/v1/edit"}
+        taskKeys = set(task[0] for task in tasks)
+        logging.info(f"    * processing {len(tasks)} requests in order of their dependencies")
+        startTime = time.monotonic()
+
+        async def processTask(taskKey, elementType, action, payload, dependencies):
+            for dependency in dependencies:
+                if await runningTasks[dependency] != "succeeded":
+                    return "skipped"
+
+            logging.debug(f"        * {action} {elementType} {taskKey}")
+            async with self._typeLocks.get(elementType, contextlib.nullcontext()):
+                res, errorMessage = await self._postRequest(f"{apiPaths[action]}/{elementType}", payload)
+            if not res:
+                logging.critical(f"!!! Error while processing {action} of {elementType}: {payload}")
+                logging.critical(f"!!! Error message from server: \"{_getErrorMessage(errorMessage)}\"!!!")
+                failures.append(errorMessage)
+                return "failed"
+            return "succeeded"
+
+        failures = []
+        runningTasks = {}
+        for taskKey, elementType, action, payload, dependencies in tasks:
+            dependencies = set(dependency for dependency in dependencies if dependency in taskKeys and dependency != taskKey)
+            # the tasks only start at the next await, so all of them exist before they wait for each other
+            runningTasks[taskKey] = asyncio.ensure_future(processTask(taskKey, elementType, action, payload, dependencies))
+
+        results = await asyncio.gather(*runningTasks.values())
+
+        duration = time.monotonic() - startTime
+        logging.info(f"        * {results.count('succeeded')} succeeded, {results.count('failed')} failed, {results.count('skipped')} skipped in {duration:.1f}s ({len(tasks) / max(duration, 0.001):.1f} requests/s)")
+
+        if len(failures) > 0:
+            raise MailcowException(failures[0])
+
+    async def _processElementList(self, elementType, elements, apiPath, processOneByOne, actionString):
+        elementCount = len(elements)
+        if elementCount <= 0:
+            return
+
+        logging.info(f"    * {actionString} {len(elements)} {elementType}s")
+
+        payloads = elements if processOneByOne else [elements]
+        startTime = time.monotonic()
+
+        results = [None] * len(payloads)
+        indexes = iter(range(len(payloads)))
+
+        # a fixed number of workers instead of one task per element, so large queues do not create many tasks at once
+        async def processPayloads():
+            for i in indexes:
+                logging.debug(f"        * {actionString} {elementType} {i+1}/{len(payloads)}")
+                async with self._typeLocks.get(elementType, contextlib.nullcontext()):
+                    results[i] = await self._postRequest(f"{apiPath}/{elementType}", payloads[i])
+
+        await asyncio.gather(*[processPayloads() for _ in range(min(self._concurrency, len(payloads)))])
+
+        failures = []
+        for payload, (res, errorMessage) in zip(payloads, results):
+            if not res:
+                logging.critical(f"!!! Error while {actionString} {elementType}: {payload}")
+                logging.critical(f"!!! Error message from server: \"{_getErrorMessage(errorMessage)}\"!!!")
+                failures.append(errorMessage)
+
+        duration = time.monotonic() - startTime
+        logging.info(f"        * {len(payloads) - len(failures)} succeeded, {len(failures)} failed in {duration:.1f}s ({len(payloads) / max(duration, 0.001):.1f} requests/s)")
+
+        if len(failures) > 0:
+            raise MailcowException(failures[0])
+
+    async def _postRequest(self, url, json_data):
+        logging.debug(f"Sending POST with JSON: {json_data}")
+
+        if self._rateController:
+            await self._rateController.acquireAsync()
+
+        startTime = time.monotonic()
+        overloaded = True
+        try:
+            with metricsHelper.mailcowRequestDuration.time(method="POST"):
+                status, rsp = await self._postWithRetries(url, json_data)
+            overloaded = status >= 500
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metricsHelper.mailcowRequestFailures.inc(method="POST")
+            return False, str(e) or repr(e)
+        finally:
+            if self._rateController:
+                self._rateController.release(time.monotonic() - startTime, overloaded)
+
+        if rsp == None:
+            return False, "Could not decode response, is mailcow still starting up?"
+
+        return _getPostResult(rsp, self._host)
+
+    async def _postWithRetries(self, url, jsonData):
+        """
+        Retries POST requests only if the connection could not be established, so the request was not sent yet,
+        like the connect retries of MailcowHelper
+        """
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                return await self._request("POST", url, jsonData)
+            except aiohttp.ClientConnectorError:
+                if attempt >= self._retries:
+                    raise
+
+    async def _request(self, method, url, jsonData=None):
+        """
+        :returns: tuple of the status and the decoded JSON response, None if it is not valid JSON
+        :raises aiohttp.ClientError, asyncio.TimeoutError: if the request failed
+        """
+        async with self._requestSlots:
+            async with self._getSession().request(method, f"{self._host}/{url}", json=jsonData) as response:
+                body = await response.read()
+        self._requestCount += 1
+
+        try:
+            return response.status, json.loads(body)
+        except ValueError:
+            return response.status, None
+
+    def _getSession(self):
+        """
+        Creates a session with a keep-alive connection pool of the same size as the number of requests in flight
+        """
+        if self._session == None:
+            traceConfig = aiohttp.TraceConfig()
+            traceConfig.on_connection_create_end.append(self._countConnection)
+            self._session = aiohttp.ClientSession(
+                headers={'X-API-Key': self._apiKey},
+                connector=aiohttp.TCPConnector(limit=self._concurrency, ssl=False),
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+                trace_configs=[traceConfig]
+            )
+        return self._session
+
+    async def _countConnection(self, session, context, params):
+        self._connectionCount += 1
+
+def _getPostResult(rsp, host):
+    """
+    :returns: tuple of success and the error message of a decoded response to a POST request
+    """
+    if isinstance(rsp, list):
+        rsp = rsp[0]
+
+    if "type" in rsp and "msg" in rsp:
+        if rsp['type'] != 'success':
+            metricsHelper.mailcowRequestFailures.inc(method="POST")
+            return False, rsp['msg']
         else:
-            return error
\ No newline at end of file
+            return True, None
+    else:
+        return False, f"Got malformed response! Is {host} a mailcow server?"
+
+def _getErrorMessage(error):
+    commonErrors = {
+        "mailbox_quota_left_exceeded": "The quota of the domain was exeeded, please choose a higher value for LINUXMUSTER_MAILCOW_DOMAIN_QUOTA"
+    }
+    if error[0] in commonErrors:
+        return commonErrors[error[0]]
+    else:
+        return error
\ No newline at end of file
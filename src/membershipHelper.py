@@ -0,0 +1,76 @@
+class MembershipResolver:
+    """
+    Resolves nested group memberships in memory instead of asking AD once per group
+    with the (expensive) LDAP_MATCHING_RULE_IN_CHAIN.
+
+    The adjacency index maps every object DN to the DNs of the groups it is a direct
+    member of (memberOf). Transitive closures are calculated once per group and cached.
+    """
+
+    def __init__(self):
+        self._parents = {}
+        self._ancestorCache = {}
+        self._watchedGroups = {}
+
+    def loadGroups(self, groups):
+        """
+        Adds the memberOf edges of groups (as returned by LdapHelper.search) to the index
+        """
+        for group in groups:
+            if "distinguishedName" not in group:
+                continue
+            self._parents[self._normalizeDn(group["distinguishedName"])] = self._normalizedParents(group)
+        self._ancestorCache = {}
+
+    def watchGroups(self, groupDns):
+        """
+        Sets the groups whose members should be collected by addMember()
+        """
+        self._watchedGroups = {self._normalizeDn(groupDn): [] for groupDn in groupDns}
+
+    def addMember(self, entry, value):
+        """
+        Appends value to the member list of every watched group entry is a (nested) member of
+        """
+        for groupDn in self.getGroupsOfEntry(entry):
+            if groupDn in self._watchedGroups:
+                self._watchedGroups[groupDn].append(value)
+
+    def getMembers(self, groupDn):
+        return self._watchedGroups.get(self._normalizeDn(groupDn), [])
+
+    def getGroupsOfEntry(self, entry):
+        """
+        :returns: the normalized DNs of all groups entry is a direct or nested member of
+        """
+        groups = set()
+        for parentDn in self._normalizedParents(entry):
+            groups.add(parentDn)
+            groups.update(self._getAncestors(parentDn))
+        return groups
+
+    def _getAncestors(self, dn):
+        if dn in self._ancestorCache:
+            return self._ancestorCache[dn]
+
+        # iterative DFS, AD allows membership cycles so we have to keep track of what we visited
+        ancestors = set()
+        stack = list(self._parents.get(dn, ()))
+        while stack:
+            parentDn = stack.pop()
+            if parentDn in ancestors or parentDn == dn:
+                continue
+            ancestors.add(parentDn)
+            if parentDn in self._ancestorCache:
+                ancestors.update(self._ancestorCache[parentDn])
+            else:
+                stack.extend(self._parents.get(parentDn, ()))
+
+        self._ancestorCache[dn] = ancestors
+        return ancestors
+
+    def _normalizedParents(self, entry):
+        return [self._normalizeDn(dn) for dn in entry.get("memberOf", [])]
+
+    def _normalizeDn(self, dn):
+        return dn.lower()
@@ -0,0 +1,150 @@
+import logging, threading, time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal implementation of the Prometheus text exposition format, so no extra dependency is needed.
+# All metrics are registered in this module and can be updated from every helper.
+
+defaultBuckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+_metrics = []
+_lock = threading.Lock()
+
+class _Metric:
+    metricType = "untyped"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metricType}"]
+        with _lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_formatLabels(labels)} {_formatValue(value)}")
+        return lines
+
+class Counter(_Metric):
+    metricType = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _labelKey(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    metricType = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_labelKey(labels)] = value
+
+    def get(self, **labels):
+        with _lock:
+            return self._values.get(_labelKey(labels))
+
+class Histogram(_Metric):
+    metricType = "histogram"
+
+    def __init__(self, name, description, buckets=defaultBuckets):
+        super().__init__(name, description)
+        self._buckets = buckets
+
+    def observe(self, value, **labels):
+        key = _labelKey(labels)
+        with _lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self._buckets), 0, 0]
+            bucketCounts, _, _ = self._values[key]
+            for i, bucket in enumerate(self._buckets):
+                if value <= bucket:
+                    bucketCounts[i] += 1
+            self._values[key][1] += value
+            self._values[key][2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metricType}"]
+        with _lock:
+            for labels, (bucketCounts, valueSum, valueCount) in self._values.items():
+                for bucket, bucketCount in zip(self._buckets, bucketCounts):
+                    lines.append(f"{self.name}_bucket{_formatLabels(labels + (('le', _formatValue(bucket)),))} {bucketCount}")
+                lines.append(f"{self.name}_bucket{_formatLabels(labels + (('le', '+Inf'),))} {valueCount}")
+                lines.append(f"{self.name}_sum{_formatLabels(labels)} {_formatValue(valueSum)}")
+                lines.append(f"{self.name}_count{_formatLabels(labels)} {valueCount}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self._histogram.observe(time.monotonic() - self._start, **self._labels)
+
+def _labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+def _formatLabels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+def startServer(port, address=""):
+    """
+    Serves /metrics on the given port from a daemon thread
+    """
+    server = ThreadingHTTPServer((address, int(port)), _MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
+
+syncStepDuration = Gauge("linuxmuster_mailcow_sync_step_duration_seconds", "Duration of the steps of the last sync")
+syncDuration = Histogram("linuxmuster_mailcow_sync_duration_seconds", "Duration of complete sync cycles")
+syncFailures = Counter("linuxmuster_mailcow_sync_failures_total", "Number of failed sync cycles")
+syncLastSuccess = Gauge("linuxmuster_mailcow_sync_last_success_timestamp_seconds", "Unix timestamp of the last successful sync")
+queueSize = Gauge("linuxmuster_mailcow_queue_size", "Number of queued elements per type and queue of the last sync")
+mailcowRequestDuration = Histogram("linuxmuster_mailcow_mailcow_request_duration_seconds", "Latency of requests to the mailcow API")
+mailcowRequestFailures = Counter("linuxmuster_mailcow_mailcow_request_failures_total", "Number of failed requests to the mailcow API")
+ldapRequestDuration = Histogram("linuxmuster_mailcow_ldap_request_duration_seconds", "Latency of LDAP operations")
+ldapRequestFailures = Counter("linuxmuster_mailcow_ldap_request_failures_total", "Number of failed LDAP operations")
+mailcowConcurrencyLimit = Gauge("linuxmuster_mailcow_mailcow_concurrency_limit", "Current limit of concurrent write requests to the mailcow API set by the rate control")
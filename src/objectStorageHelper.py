@@ -1,10 +1,39 @@
-import math
+import math, json, re
+
+class MailcowRecord:
+    """
+    Compact representation of an object loaded from mailcow.
+    Only the primary key and the fingerprint of the compared values are kept, not the whole raw API response.
+    """
+    __slots__ = ("key", "fingerprint")
+
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+
+class MailcowRecordWithId(MailcowRecord):
+    """
+    Record for objects which are deleted and edited by their numeric id (aliases and filters)
+    """
+    __slots__ = ("id",)
+
+    def __init__(self, key, fingerprint, id):
+        super().__init__(key, fingerprint)
+        self.id = id
 
 class TemporaryObjectListStorage:
     primaryKey = "INVALID"
+    # maximum number of items in one edit request, mailcow processes them one by one in a single request
+    updateBatchSize = 100
+    # the keys (as used in POST requests) which are compared to detect changes
+    comparedKeys = []
+    # For some stupid reason mailcow decided to use different keys in POST and GET
+    getKeyNames = {}
+    # The quota is given in bytes by mailcow, but we have mebibytes
+    quotaKeyNames = []
 
     def __init__(self):
-        self._current = {}
+        self._current = set()
         self._managed = {}
         self._addQueue = {}
         self._updateQueue = {}
@@ -14,10 +43,30 @@ class TemporaryObjectListStorage:
 
     def loadRawData(self, rawData):
         for element in rawData:
-            self._current[element[self._primaryKey]] = element
+            elementId = element[self._primaryKey]
+            self._current.add(elementId)
             if self._checkElementValidity(element):
-                self._managed[element[self._primaryKey]] = element
-                self._killQueue[element[self._primaryKey]] = element
+                self._loadElement(element)
+
+    def getRecords(self):
+        """
+        :returns: list of (key, fingerprint, id) of all managed elements, id is None for types without id
+        """
+        return [(record.key, record.fingerprint, getattr(record, "id", None)) for record in self._managed.values()]
+
+    def getUnmanagedKeys(self):
+        return [elementId for elementId in self._current if elementId not in self._managed]
+
+    def loadRecords(self, records, unmanagedKeys):
+        """
+        Restores the state saved with getRecords() and getUnmanagedKeys() instead of loading it from mailcow
+        """
+        self._current.update(unmanagedKeys)
+        for key, fingerprint, id in records:
+            record = self._restoreRecord(key, fingerprint, id)
+            self._current.add(key)
+            self._managed[key] = record
+            self._killQueue[key] = record
 
     def addElement(self, element, elementId):
         """
@@ -32,7 +81,7 @@ class TemporaryObjectListStorage:
                 del self._killQueue[elementId]
 
             if self._checkElementChanges(element, elementId): 
-                self._updateQueue[elementId] = element
+                self._updateQueue[elementId] = self._getChangedValues(element, elementId)
                 
         elif elementId in self._current:
             return False
@@ -53,14 +102,24 @@ class TemporaryObjectListStorage:
 
 
     def updateQueue(self):
-        queue = []
+        """
+        Groups all updates with identical changed values into one edit request with many items
+        """
+        groups = {}
         for key, value in self._updateQueue.items():
-            queue.append({
-            "attr": value,
-            "items": [key]
-        })
-        return queue
+            groupKey = json.dumps(value, sort_keys=True)
+            if groupKey not in groups:
+                groups[groupKey] = {"attr": value, "items": []}
+            groups[groupKey]["items"].append(self._getUpdateItemId(key))
 
+        queue = []
+        for group in groups.values():
+            for i in range(0, len(group["items"]), self.updateBatchSize):
+                queue.append({
+                "attr": group["attr"],
+                "items": group["items"][i:i + self.updateBatchSize]
+            })
+        return queue
 
     def killQueue(self):
         return self.getQueueAsList(self._killQueue)
@@ -68,26 +127,71 @@ class TemporaryObjectListStorage:
     def queuesAreEmpty(self):
         return len(self._killQueue) == 0 and len(self._addQueue) == 0 and len(self._updateQueue) == 0
 
+    def getQueueCounts(self):
+        return {
+            "add": len(self._addQueue),
+            "update": len(self._updateQueue),
+            "kill": len(self._killQueue)
+        }
+
     def getQueueCountsString(self, descriptor):
         return f"Going to add {len(self._addQueue)} {descriptor}, update {len(self._updateQueue)} {descriptor} and kill {len(self._killQueue)} {descriptor}"
 
     def _checkElementChanges(self, element, elementId):
         """
-        Checks if an element has changed
+        Checks if an element has changed by comparing its fingerprint to the one of the current element
         :returns: True if changed, False if not
         """
-        currentElement = self._managed[elementId]
+        return self._getFingerprint(element) != self._managed[elementId].fingerprint
+
+    def _getChangedValues(self, element, elementId):
+        """
+        :returns: only the values of element which differ from the current element
+        """
+        changedValues = {}
+        for key, newValue, currentValue in zip(self.comparedKeys, self._getFingerprint(element), self._managed[elementId].fingerprint):
+            if key in element and newValue != currentValue:
+                changedValues[key] = element[key]
+        return changedValues
+
+    def _getFingerprint(self, element):
+        """
+        :returns: a hashable tuple of the normalized values of all compared keys of an element we want to have
+        """
+        fingerprint = []
+        for key in self.comparedKeys:
+            value = element.get(key)
+            if value != None and key in self.quotaKeyNames:
+                value = int(value)
+            fingerprint.append(value)
+        return tuple(fingerprint)
+
+    def _getCurrentFingerprint(self, element):
+        """
+        :returns: a hashable tuple of the normalized values of all compared keys of an element as returned by mailcow,
+                  which can be compared to the result of _getFingerprint()
+        """
+        fingerprint = []
+        for key in self.comparedKeys:
+            value = element.get(self.getKeyNames.get(key, key))
+            if value != None and key in self.quotaKeyNames:
+                value = self._convertBytesToMebibytes(value)
+            fingerprint.append(value)
+        return tuple(fingerprint)
 
-        for key, value in element.items():
-            if self._checkElementValueDelta(key, currentElement, value):
-                #currentValue = "" if key not in currentElement else currentElement[key]
-                #print(f"Found delta in {key}. Current: {currentValue} new: {value}")
-                return True
+    def _loadElement(self, element):
+        record = self._createRecord(element)
+        self._managed[record.key] = record
+        self._killQueue[record.key] = record
 
-        return False
+    def _createRecord(self, element):
+        return MailcowRecord(element[self._primaryKey], self._getCurrentFingerprint(element))
 
-    def _checkElementValueDelta(self, key, currentElement, newValue):
-        return key not in currentElement or currentElement[key] != newValue
+    def _restoreRecord(self, key, fingerprint, id):
+        return MailcowRecord(key, fingerprint)
+
+    def _getUpdateItemId(self, elementId):
+        return elementId
 
     def _checkElementValidity(self, element):
         return True
@@ -104,100 +208,114 @@ class TemporaryObjectListStorage:
 class DomainListStorage(TemporaryObjectListStorage):
     primaryKey = "domain_name"
     validityCheckDescription = "#### managed by linuxmuster ####"
+    comparedKeys = ["defquota", "maxquota", "quota", "description", "active", "mailboxes", "aliases", "gal"]
+    getKeyNames = {
+        "maxquota": "max_quota_for_mbox",
+        "defquota": "def_quota_for_mbox",
+        "quota": "max_quota_for_domain",
+        "mailboxes": "max_num_mboxes_for_domain",
+        "aliases": "max_num_aliases_for_domain"
+    }
+    quotaKeyNames = ["maxquota", "defquota", "quota"]
 
     def killQueue(self):
-        return list(map(lambda x: x["domain_name"], super().killQueue()))
-
-    def _checkElementValueDelta(self, key, currentElement, newValue):
-        ignoreKeys = ["domain", "restart_sogo"]
-        # For some stupid reason mailcow decided to use different keys in POST and GET
-        getKeyNames = {
-            "maxquota": "max_quota_for_mbox",
-            "defquota": "def_quota_for_mbox",
-            "quota": "max_quota_for_domain",
-            "mailboxes": "max_num_mboxes_for_domain",
-            "aliases": "max_num_aliases_for_domain"
-        }
-        quotaKeyNames = ["max_quota_for_mbox", "def_quota_for_mbox", "max_quota_for_domain"]
-
-        if key in getKeyNames:
-            key = getKeyNames[key]
-
-        if key in ignoreKeys:
-            return False
-        elif key in quotaKeyNames:
-            # The quota is given in bytes by mailcow, but we have mebibytes
-            currentQuota = self._convertBytesToMebibytes(currentElement[key])
-            newQuota = int(newValue)
-            #print(f"Current {key}: {currentQuota} new: {newQuota} raw: {currentElement[key]}")
-            return currentQuota != newQuota
-        else:
-            return super()._checkElementValueDelta(key, currentElement, newValue)
+        return list(map(lambda x: x.key, super().killQueue()))
 
     def _checkElementValidity(self, element):
         return element["description"] == self.validityCheckDescription
 
-class MailboxListStorage(TemporaryObjectListStorage):
-    primaryKey = "username"
+class DomainDependentListStorage(TemporaryObjectListStorage):
+    """
+    Storage for elements which are only managed if their domain is managed.
+    They can be loaded before the domains, but are only classified when classifyElements() is called.
+    """
 
     def __init__(self, domainListStorage):
         super().__init__()
         self._domainListStorage = domainListStorage
+        self._unclassified = []
 
-    def killQueue(self):
-        return list(map(lambda x: x["username"], super().killQueue()))
+    def classifyElements(self):
+        """
+        Marks all loaded elements of a managed domain as managed. Has to be called after the domains were loaded.
+        """
+        for record, domain in self._unclassified:
+            if domain in self._domainListStorage._managed:
+                self._managed[record.key] = record
+                self._killQueue[record.key] = record
+        self._unclassified = []
 
-    def _checkElementValueDelta(self, key, currentElement, newValue):
-        ignoreKeys = ["password", "password2"]
-        if key in ignoreKeys:
-            return False
-        elif key not in currentElement:
-            return True
-        elif key == "quota":
-            # The quota is given in bytes by mailcow, but we have mebibytes
-            currentQuota = self._convertBytesToMebibytes(currentElement[key])
-            newQuota = int(newValue)
-            #print(f"Current quota: {currentQuota} new: {newQuota}")
-            return currentQuota != newQuota
-        else:
-            return super()._checkElementValueDelta(key, currentElement, newValue)
+    def _loadElement(self, element):
+        self._unclassified.append((self._createRecord(element), self._getElementDomain(element)))
 
-    def _checkElementValidity(self, element):
-        return element["domain"] in self._domainListStorage._managed
+    def _getElementDomain(self, element):
+        return element["domain"]
 
-class AliasListStorage(TemporaryObjectListStorage):
-    primaryKey = "address"
+class MailboxListStorage(DomainDependentListStorage):
+    primaryKey = "username"
+    comparedKeys = ["domain", "local_part", "active", "quota", "name"]
+    quotaKeyNames = ["quota"]
 
-    def __init__(self, domainListStorage):
-        super().__init__()
-        self._domainListStorage = domainListStorage
+    def killQueue(self):
+        return list(map(lambda x: x.key, super().killQueue()))
+
+class AliasListStorage(DomainDependentListStorage):
+    primaryKey = "address"
+    comparedKeys = ["address", "goto", "active", "sogo_visible"]
 
     def killQueue(self):
-        return list(map(lambda x: x["id"], super().killQueue()))
+        return list(map(lambda x: x.id, super().killQueue()))
 
-    def _checkElementValidity(self, element):
-        return element["domain"] in self._domainListStorage._managed
+    def _createRecord(self, element):
+        return MailcowRecordWithId(element[self._primaryKey], self._getCurrentFingerprint(element), element["id"])
 
-class FilterListStorage(TemporaryObjectListStorage):
-    primaryKey = "username"
+    def _restoreRecord(self, key, fingerprint, id):
+        return MailcowRecordWithId(key, fingerprint, id)
 
-    def __init__(self, domainListStorage):
-        super().__init__()
-        self._domainListStorage = domainListStorage
+class FilterListStorage(DomainDependentListStorage):
+    primaryKey = "username"
+    comparedKeys = ["active", "username", "filter_type", "script_data", "script_desc"]
+    # Generated scripts contain a digest of their members in this line, which is compared instead of the whole script
+    scriptDigestPrefix = "# member digest: "
+    scriptDigestPattern = re.compile(r"^" + re.escape(scriptDigestPrefix) + r"([0-9a-f]+)\r?$", re.MULTILINE)
+    scriptDigestSearchLength = 512
 
     def killQueue(self):
-        return list(map(lambda x: x["id"], super().killQueue()))
+        return list(map(lambda x: x.id, super().killQueue()))
 
-    def updateQueue(self):
-        queue = []
-        for key, value in self._updateQueue.items():
-            filterId = self._managed[key]["id"]
-            queue.append({
-            "attr": value,
-            "items": [filterId]
-        })
-        return queue
+    def _createRecord(self, element):
+        return MailcowRecordWithId(element[self._primaryKey], self._getCurrentFingerprint(element), element["id"])
+
+    def _restoreRecord(self, key, fingerprint, id):
+        return MailcowRecordWithId(key, fingerprint, id)
+
+    def _getUpdateItemId(self, elementId):
+        return self._managed[elementId].id
+
+    def _getFingerprint(self, element):
+        return self._replaceScriptByDigest(super()._getFingerprint(element))
+
+    def _getCurrentFingerprint(self, element):
+        return self._replaceScriptByDigest(super()._getCurrentFingerprint(element))
+
+    def _replaceScriptByDigest(self, fingerprint):
+        """
+        Replaces the script in a fingerprint by its member digest. Scripts without a digest are kept as they are,
+        so they never match a generated script and are replaced.
+        """
+        scriptIndex = self.comparedKeys.index("script_data")
+        script = fingerprint[scriptIndex]
+        if script == None:
+            return fingerprint
+
+        match = self.scriptDigestPattern.search(script, 0, self.scriptDigestSearchLength)
+        if match == None:
+            return fingerprint
+
+        return fingerprint[:scriptIndex] + (self.scriptDigestPrefix + match.group(1),) + fingerprint[scriptIndex + 1:]
+
+    def _getElementDomain(self, element):
+        return element["username"].split("@")[-1]
 
     def _checkElementValidity(self, element):
-        domain = element["username"].split("@")[-1]
-        return domain in self._domainListStorage._managed and element["filter_type"] == "prefilter" and element["active"] == 1
\ No newline at end of file
+        return element["filter_type"] == "prefilter" and element["active"] == 1
\ No newline at end of file
@@ -0,0 +1,92 @@
+import json, time, logging
+
+# A plan contains the queues of one sync as JSON Lines:
+# - the first line is a summary with the number of queued elements, plan entries and estimated requests per type
+#   (updates with identical changes are batched, so one update entry can contain many elements)
+# - every other line is one queued element: {"type": ..., "queue": "kill"|"add"|"update", "element": ...}
+# Queued mailboxes contain their random initial password, so plans should be treated like secrets.
+
+planVersion = 2
+queueNames = ["kill", "add", "update"]
+
+def estimateRequests(queue, queueName):
+    """
+    :returns: the number of requests needed to apply a queue, deletions are sent in one request
+    """
+    if queueName == "kill":
+        return 1 if len(queue) > 0 else 0
+    return len(queue)
+
+def getSummary(queues, counts):
+    """
+    :param queues: dict of element type -> dict of queue name -> list of entries
+    :param counts: dict of element type -> dict of queue name -> number of queued elements
+    """
+    entries = {}
+    estimatedRequests = {}
+    for elementType, typeQueues in queues.items():
+        entries[elementType] = {queueName: len(typeQueues[queueName]) for queueName in queueNames}
+        estimatedRequests[elementType] = sum(estimateRequests(typeQueues[queueName], queueName) for queueName in queueNames)
+
+    return {
+        "type": "summary",
+        "version": planVersion,
+        "createdAt": time.time(),
+        "counts": counts,
+        "entries": entries,
+        "estimatedRequests": estimatedRequests,
+        "totalEstimatedRequests": sum(estimatedRequests.values())
+    }
+
+def writePlan(file, queues, counts):
+    """
+    Writes the queues as JSON Lines to an open text file
+    :param counts: see getSummary()
+    :returns: the summary
+    """
+    summary = getSummary(queues, counts)
+    file.write(json.dumps(summary) + "\n")
+    for elementType, typeQueues in queues.items():
+        for queueName in queueNames:
+            for element in typeQueues[queueName]:
+                file.write(json.dumps({"type": elementType, "queue": queueName, "element": element}) + "\n")
+    return summary
+
+def readPlan(file):
+    """
+    Reads a plan written by writePlan()
+    :returns: tuple of the summary and the queues
+    :raises ValueError: if the file is not a valid plan
+    """
+    summary = None
+    queues = {}
+    for lineNumber, line in enumerate(file, 1):
+        if line.strip() == "":
+            continue
+
+        entry = json.loads(line)
+        if summary == None:
+            if entry.get("type") != "summary" or entry.get("version") != planVersion:
+                raise ValueError("The plan does not start with a supported summary")
+            summary = entry
+            queues = {elementType: {queueName: [] for queueName in queueNames} for elementType in summary["entries"]}
+            continue
+
+        if entry.get("type") not in queues or entry.get("queue") not in queueNames:
+            raise ValueError(f"Invalid entry in line {lineNumber}")
+        queues[entry["type"]][entry["queue"]].append(entry["element"])
+
+    if summary == None:
+        raise ValueError("The plan is empty")
+
+    for elementType, typeQueues in queues.items():
+        for queueName in queueNames:
+            if len(typeQueues[queueName]) != summary["entries"][elementType][queueName]:
+                raise ValueError(f"The plan is incomplete, expected {summary['entries'][elementType][queueName]} entries in the {queueName} queue of {elementType}")
+
+    return summary, queues
+
+def logSummary(summary):
+    for elementType, counts in summary["counts"].items():
+        logging.info(f"    * {elementType}: add {counts['add']}, update {counts['update']}, kill {counts['kill']} ({summary['estimatedRequests'][elementType]} requests)")
+    logging.info(f"    * {summary['totalEstimatedRequests']} requests in total")
@@ -0,0 +1,150 @@
+import logging, threading, time, datetime, asyncio
+import metricsHelper
+
+class RateController:
+    """
+    Limits the number of concurrent write requests to mailcow with AIMD (additive increase, multiplicative decrease):
+    - every fast and successful request increases the limit by 1/limit, so about +1 per round trip
+    - a slow request (above targetLatency) or a server error halves the limit, at most once per round trip
+    - the limit starts at minConcurrency and is never decreased below it
+
+    The limit never exceeds a ceiling, which can be different during quiet hours (e.g. at night).
+    Additionally, a maximum number of requests per second can be set for both profiles.
+
+    Threads use acquire(), the async engine uses acquireAsync(). Both must not be used at the same time,
+    as the release() of the async engine wakes its waiters in the event loop.
+    """
+
+    def __init__(self, targetLatency, maxConcurrency, maxRate=0, quietHours="", quietMaxConcurrency=None, quietMaxRate=None, minConcurrency=1):
+        self._targetLatency = float(targetLatency)
+        self._minConcurrency = max(float(minConcurrency), 1.0)
+        self._profiles = {
+            "normal": (int(maxConcurrency), float(maxRate)),
+            "quiet": (
+                int(quietMaxConcurrency if quietMaxConcurrency != None else maxConcurrency),
+                float(quietMaxRate if quietMaxRate != None else maxRate)
+            )
+        }
+        self._quietHours = self._parseHours(quietHours)
+
+        self._condition = threading.Condition()
+        # created in the event loop by acquireAsync()
+        self._asyncRelease = None
+        self._limit = self._minConcurrency
+        self._inFlight = 0
+        self._lastDecrease = 0
+        self._nextRequestTime = 0
+
+    def getMaxConcurrency(self):
+        """
+        :returns: the highest possible number of concurrent requests of all profiles
+        """
+        return max(maxConcurrency for maxConcurrency, _ in self._profiles.values())
+
+    def acquire(self):
+        """
+        Blocks until another request may be sent
+        """
+        with self._condition:
+            while True:
+                delay = self._tryAcquire()
+                if delay != None:
+                    break
+                self._condition.wait(1)
+
+        # sleep outside of the lock, so other requests can reserve their slots meanwhile
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquireAsync(self):
+        """
+        Waits in the event loop until another request may be sent, so waiting requests do not block any threads
+        """
+        if self._asyncRelease == None:
+            self._asyncRelease = asyncio.Event()
+
+        while True:
+            delay = self._tryAcquire()
+            if delay != None:
+                break
+            self._asyncRelease.clear()
+            # the profile may change while waiting, like in acquire()
+            try:
+                await asyncio.wait_for(self._asyncRelease.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _tryAcquire(self):
+        """
+        Reserves a slot if the limit allows it
+        :returns: seconds to wait before sending because of the maximum rate, None if no slot is free
+        """
+        with self._condition:
+            maxConcurrency, maxRate = self._getProfile()
+            if self._inFlight >= min(int(self._limit), maxConcurrency):
+                return None
+
+            self._inFlight += 1
+
+            delay = 0
+            if maxRate > 0:
+                now = time.monotonic()
+                delay = max(self._nextRequestTime - now, 0)
+                self._nextRequestTime = max(self._nextRequestTime, now) + 1 / maxRate
+            return delay
+
+    def release(self, latency, overloaded):
+        """
+        :param latency: duration of the request in seconds
+        :param overloaded: True if the server failed in a way which indicates overload (timeout, 5xx)
+        """
+        with self._condition:
+            self._inFlight -= 1
+            maxConcurrency, _ = self._getProfile()
+            now = time.monotonic()
+
+            if overloaded or latency > self._targetLatency:
+                # only one decrease per round trip, the other slow requests were sent with the same limit
+                if now - self._lastDecrease > latency:
+                    self._limit = max(self._limit / 2, self._minConcurrency)
+                    self._lastDecrease = now
+                    logging.debug(f"Decreased mailcow request concurrency to {int(self._limit)} (latency {latency:.2f}s)")
+            elif self._inFlight + 1 >= int(self._limit):
+                # only grow if the limit was actually reached, otherwise it would grow without being tested
+                self._limit = min(self._limit + 1 / self._limit, float(maxConcurrency))
+
+            metricsHelper.mailcowConcurrencyLimit.set(int(self._limit))
+            self._condition.notify_all()
+
+        if self._asyncRelease != None:
+            self._asyncRelease.set()
+
+    def _getProfile(self):
+        return self._profiles["quiet" if self._isQuietTime() else "normal"]
+
+    def _isQuietTime(self):
+        if self._quietHours == None:
+            return False
+        start, end = self._quietHours
+        hour = datetime.datetime.now().hour
+        if start <= end:
+            return start <= hour < end
+        # over midnight, e.g. 22-6
+        return hour >= start or hour < end
+
+    def _parseHours(self, hours):
+        """
+        :param hours: range of hours like "22-6", or "" for none
+        """
+        if hours.strip() == "":
+            return None
+        try:
+            start, end = [int(hour) for hour in hours.split("-")]
+        except ValueError:
+            raise ValueError(f"Invalid range of hours {hours!r}, expected something like 22-6")
+        if not (0 <= start <= 23 and 0 <= end <= 24):
+            raise ValueError(f"Invalid range of hours {hours!r}, expected something like 22-6")
+        return start, end
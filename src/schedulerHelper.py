@@ -0,0 +1,116 @@
+import logging, os, random, signal, socket, threading, time
+
+class SyncScheduler:
+    """
+    Calculates the pause between two sync cycles and wakes up early when a sync is triggered.
+
+    - after a cycle which applied changes, the next one follows after minInterval (more changes are likely to follow)
+    - every cycle without changes doubles the interval, up to maxInterval
+    - failed cycles are retried with exponential backoff from failureInterval up to maxBackoff
+    - all intervals are randomized by +/- jitter, so multiple servers using one mailcow do not align
+
+    A sync can be triggered with SIGUSR1 or by connecting to the trigger socket.
+    """
+
+    # seconds in which wait() checks if a sync was triggered by a signal
+    signalPollInterval = 1
+
+    def __init__(self, interval, minInterval, maxInterval, maxBackoff, jitter, failureInterval=30):
+        self._interval = int(interval)
+        self._minInterval = min(int(minInterval), self._interval)
+        self._maxInterval = max(int(maxInterval), self._interval)
+        self._maxBackoff = int(maxBackoff)
+        self._failureInterval = min(failureInterval, self._maxBackoff)
+        self._jitter = float(jitter)
+
+        self._nextInterval = self._interval
+        self._failures = 0
+        self._trigger = threading.Event()
+        self._signalled = False
+
+    def cycleSucceeded(self, foundDeltas):
+        self._failures = 0
+        if foundDeltas:
+            self._nextInterval = self._minInterval
+        elif self._nextInterval < self._interval:
+            # back to normal after a quiet cycle
+            self._nextInterval = self._interval
+        else:
+            self._nextInterval = min(self._nextInterval * 2, self._maxInterval)
+
+    def cycleFailed(self):
+        self._failures += 1
+        # the first successful cycle after a failure is followed by the normal interval
+        self._nextInterval = self._minInterval
+
+    def getNextInterval(self):
+        """
+        :returns: seconds until the next cycle, including jitter
+        """
+        interval = self._getBackoff() if self._failures > 0 else self._nextInterval
+        return max(1, round(interval * random.uniform(1 - self._jitter, 1 + self._jitter)))
+
+    def wait(self):
+        """
+        Sleeps until the next cycle is due or a sync was triggered
+        :returns: True if the sync was triggered
+        """
+        interval = self.getNextInterval()
+        logging.info(f"sleeping {interval} seconds before next cycle")
+        deadline = time.monotonic() + interval
+        triggered = False
+        while not triggered and time.monotonic() < deadline:
+            # the signal handler only sets a flag, which is polled here
+            triggered = self._trigger.wait(min(deadline - time.monotonic(), self.signalPollInterval)) or self._signalled
+        self._trigger.clear()
+        self._signalled = False
+        if triggered:
+            logging.info("A sync was triggered")
+        return triggered
+
+    def trigger(self):
+        self._trigger.set()
+
+    def installSignalHandler(self, signalNumber=signal.SIGUSR1):
+        # Event.set() takes a lock, which could deadlock in a signal handler
+        signal.signal(signalNumber, self._handleSignal)
+
+    def _handleSignal(self, signalNumber, frame):
+        self._signalled = True
+
+    def listenOnSocket(self, path):
+        """
+        Triggers a sync for every connection to the unix socket at path, from a daemon thread
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+
+        thread = threading.Thread(target=self._acceptTriggers, args=(server,), daemon=True)
+        thread.start()
+        logging.info(f"Listening for sync triggers on {path}")
+        return server
+
+    def _acceptTriggers(self, server):
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError as e:
+                logging.warning(f"Error accepting a sync trigger: {e}")
+                # do not spin if the error persists, e.g. when running out of file descriptors
+                time.sleep(1)
+                continue
+
+            try:
+                with connection:
+                    self.trigger()
+                    connection.sendall(b"sync triggered\n")
+            except OSError as e:
+                # e.g. the client closed the connection early
+                logging.warning(f"Error answering a sync trigger: {e}")
+
+    def _getBackoff(self):
+        return min(self._failureInterval * 2 ** (self._failures - 1), self._maxBackoff)
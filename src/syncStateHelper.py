@@ -0,0 +1,124 @@
+import sqlite3, json, time, datetime, logging
+
+from contextlib import closing
+
+class SyncStateStore:
+    """
+    Persists the last verified state of all managed mailcow objects (key, fingerprint and id) in an SQLite file.
+
+    As long as the state is verified and no changes were applied since, the syncer can calculate
+    the deltas against it instead of loading everything from mailcow again. This also survives restarts.
+    Errors of the state file (locked, read-only, corrupt) are logged and reported by the return values,
+    so the syncer can fall back to loading from mailcow.
+    """
+
+    def __init__(self, path, verifyInterval):
+        self._path = path
+        self._verifyInterval = int(verifyInterval)
+        self._createTables()
+
+    def isUpToDate(self):
+        """
+        :returns: True if the state was verified less than verifyInterval seconds ago and nothing was changed since
+        """
+        try:
+            verifiedAt = self._getMetaValue("verifiedAt")
+            dirty = self._getMetaValue("dirty")
+        except sqlite3.Error as e:
+            logging.warning(f"Could not read sync state: {e}")
+            return False
+
+        if verifiedAt == None or dirty != "0":
+            return False
+
+        return time.time() - float(verifiedAt) < self._verifyInterval
+
+    def save(self, storages):
+        """
+        Saves the state of all storages as verified
+        :param storages: dict of element type -> storage
+        :returns: True on success
+        """
+        try:
+            with closing(sqlite3.connect(self._path)) as connection:
+                with connection:
+                    connection.execute("DELETE FROM elements")
+                    for elementType, storage in storages.items():
+                        connection.executemany(
+                            "INSERT INTO elements (elementType, elementKey, fingerprint, elementId) VALUES (?, ?, ?, ?)",
+                            [(elementType, key, json.dumps(fingerprint), id) for key, fingerprint, id in storage.getRecords()]
+                        )
+                        connection.executemany(
+                            "INSERT INTO elements (elementType, elementKey, fingerprint, elementId) VALUES (?, ?, NULL, NULL)",
+                            [(elementType, key) for key in storage.getUnmanagedKeys()]
+                        )
+                    self._setMetaValue(connection, "verifiedAt", str(time.time()))
+                    self._setMetaValue(connection, "dirty", "0")
+        except sqlite3.Error as e:
+            logging.warning(f"Could not save sync state: {e}")
+            return False
+        return True
+
+    def load(self, storages):
+        """
+        Loads the saved state into the storages. Nothing is loaded into them if the state cannot be read completely.
+        :param storages: dict of element type -> storage
+        :returns: True on success
+        """
+        try:
+            verifiedAt = self._getMetaValue("verifiedAt")
+            states = {}
+            with closing(sqlite3.connect(self._path)) as connection:
+                for elementType in storages:
+                    records = []
+                    unmanagedKeys = []
+                    rows = connection.execute(
+                        "SELECT elementKey, fingerprint, elementId FROM elements WHERE elementType = ?",
+                        (elementType,)
+                    )
+                    for key, fingerprint, id in rows:
+                        if fingerprint == None:
+                            unmanagedKeys.append(key)
+                        else:
+                            records.append((key, tuple(json.loads(fingerprint)), id))
+                    states[elementType] = (records, unmanagedKeys)
+        except (sqlite3.Error, ValueError) as e:
+            logging.warning(f"Could not load sync state: {e}")
+            return False
+
+        logging.info(f"    * The sync state was last verified with Mailcow at {datetime.datetime.fromtimestamp(float(verifiedAt))}")
+        for elementType, (records, unmanagedKeys) in states.items():
+            storages[elementType].loadRecords(records, unmanagedKeys)
+        return True
+
+    def markDirty(self):
+        """
+        Has to be called before changes are applied to mailcow, so the state is verified again in the next cycle
+        :returns: True on success, changes must not be applied otherwise
+        """
+        try:
+            with closing(sqlite3.connect(self._path)) as connection:
+                with connection:
+                    self._setMetaValue(connection, "dirty", "1")
+        except sqlite3.Error as e:
+            logging.critical(f"!!! Could not mark the sync state as dirty: {e} !!!")
+            return False
+        return True
+
+    def _createTables(self):
+        try:
+            with closing(sqlite3.connect(self._path)) as connection:
+                with connection:
+                    connection.execute("CREATE TABLE IF NOT EXISTS elements (elementType TEXT, elementKey TEXT, fingerprint TEXT, elementId INTEGER, PRIMARY KEY (elementType, elementKey))")
+                    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        except sqlite3.Error as e:
+            # isUpToDate() will report the state as outdated, so mailcow is used instead
+            logging.warning(f"Could not create sync state tables: {e}")
+
+    def _getMetaValue(self, key):
+        with closing(sqlite3.connect(self._path)) as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row == None else row[0]
+
+    def _setMetaValue(self, connection, key, value):
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
@@ -1,11 +1,17 @@
-import sys, os, string, time, datetime, logging, coloredlogs, random
-import templateHelper
+import sys, os, string, time, datetime, logging, coloredlogs, random, threading, hashlib, asyncio, tempfile
+import argparse, templateHelper, metricsHelper, planHelper
 
-from mailcowHelper import MailcowHelper, MailcowException
-from ldapHelper import LdapHelper
+from mailcowHelper import MailcowHelper, AsyncMailcowHelper, MailcowException
+from ldapHelper import LdapHelper, LdapException, LdapAttribute
+from membershipHelper import MembershipResolver
+from directorySnapshotHelper import DirectorySnapshot
 from objectStorageHelper import DomainListStorage, MailboxListStorage, AliasListStorage, FilterListStorage
-from dockerapiHelper import DockerapiHelper
+from dockerapiHelper import DockerapiHelper, AsyncDockerapiHelper
+from syncStateHelper import SyncStateStore
+from schedulerHelper import SyncScheduler
+from rateControlHelper import RateController
 from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
 
 coloredlogs.install(level='INFO', fmt='%(asctime)s - [%(levelname)s] %(message)s')
 
@@ -14,179 +20,933 @@ class LinuxmusterMailcowSyncer:
     ldapSogoUserFilter = "(sophomorixRole='student' OR sophomorixRole='teacher' OR sophomorixRole='schooladministrator')"
     ldapUserFilter = "(|(sophomorixRole=student)(sophomorixRole=teacher)(sophomorixRole=schooladministrator))"
     ldapMailingListFilter = "(|(sophomorixType=adminclass)(sophomorixType=project))"
-    ldapMailingListMemberFilter = f"(&(memberof:1.2.840.113556.1.4.1941:=@@mailingListDn@@){ldapUserFilter})"
+    ldapGroupFilter = "(objectClass=group)"
 
-    def __init__(self):
+    ldapUserRoles = ["student", "teacher", "schooladministrator"]
+    ldapMailingListTypes = ["adminclass", "project"]
+
+    ldapUserAttributes = ["mail", "proxyAddresses", "sophomorixStatus", "sophomorixMailQuotaCalculated", "displayName", "memberOf"]
+    ldapMailingListAttributes = ["mail", "distinguishedName", "sophomorixMailList", "sAMAccountName"]
+    ldapGroupAttributes = ["distinguishedName", "memberOf"]
+
+    # storage type -> element type as used in mailcow requests
+    storageElementTypes = {"domain": "domain", "mailbox": "mailbox", "alias": "alias", "filters": "filter"}
+
+    # shapes and types of the attributes in search results
+    ldapAttributeSchema = {
+        "distinguishedName": LdapAttribute(),
+        "mail": LdapAttribute(),
+        "proxyAddresses": LdapAttribute(multiValued=True),
+        "memberOf": LdapAttribute(multiValued=True),
+        "displayName": LdapAttribute(),
+        "sAMAccountName": LdapAttribute(),
+        "sophomorixRole": LdapAttribute(),
+        "sophomorixType": LdapAttribute(),
+        "sophomorixStatus": LdapAttribute(),
+        "sophomorixMailQuotaCalculated": LdapAttribute(valueType=int),
+        "sophomorixMailList": LdapAttribute(valueType=bool)
+    }
+
+    # the async engine hands the users from the LDAP thread to the delta calculation in pages of this size,
+    # at most this many pages are buffered
+    asyncUserPageSize = 500
+    asyncUserPageQueueSize = 16
+
+    def __init__(self, ldapHelper=None, applyTemplates=True):
+        """
+        :param ldapHelper: use this instead of an LdapHelper created from the config (used by the benchmark)
+        :param applyTemplates: whether to apply the dovecot and sogo config templates
+        """
         self._config = self._readConfig()
 
+        self._rateController = None
+        self._apiWorkers = int(self._config['API_WORKERS'])
+        if self._config['API_RATE_CONTROL'] == "1":
+            self._rateController = RateController(
+                self._config['API_TARGET_LATENCY'],
+                self._config['API_MAX_CONCURRENCY'],
+                self._config['API_MAX_RATE'],
+                self._config['API_QUIET_HOURS'],
+                self._config['API_QUIET_MAX_CONCURRENCY'],
+                self._config['API_QUIET_MAX_RATE'],
+                self._config['API_MIN_CONCURRENCY']
+                )
+            # the rate control decides how many of the workers may send at once
+            self._apiWorkers = self._rateController.getMaxConcurrency()
+
         self._mailcow = MailcowHelper(
             self._config['API_URI'],
-            self._config['API_KEY']
+            self._config['API_KEY'],
+            max(int(self._config['API_POOL_SIZE']), self._apiWorkers),
+            self._config['API_TIMEOUT'],
+            self._config['API_RETRIES'],
+            self._apiWorkers,
+            self._rateController
             )
-        self._ldap = LdapHelper(
+        self._ldap = ldapHelper or LdapHelper(
             self._config['LDAP_URI'], 
             self._config['LDAP_BIND_DN'], 
             self._config['LDAP_BIND_DN_PASSWORD'], 
-            self._config['LDAP_BASE_DN']
+            self._config['LDAP_BASE_DN'],
+            self._config['LDAP_PAGE_SIZE'],
+            self._config['LDAP_FAILOVER_URIS'],
+            self._config['LDAP_START_TLS'] == "1",
+            self._config['LDAP_TIMEOUT'],
+            self._config['LDAP_CONNECT_RETRIES'],
+            self.ldapAttributeSchema
+            )
+
+        self._adSnapshot = None
+        if self._config['LDAP_INCREMENTAL'] == "1":
+            self._adSnapshot = DirectorySnapshot(
+                self._ldap,
+                self.ldapUserFilter,
+                self.ldapUserAttributes,
+                self.ldapUserRoles,
+                self.ldapMailingListAttributes + self.ldapGroupAttributes,
+                self.ldapMailingListTypes,
+                self._config['LDAP_FULL_SYNC_INTERVAL']
+                )
+
+        self._syncState = None
+        if self._config['STATE_FILE'] != "":
+            self._syncState = SyncStateStore(self._config['STATE_FILE'], self._config['STATE_VERIFY_INTERVAL'])
+
+        # one thread per mailcow object type
+        self._mailcowLoader = ThreadPoolExecutor(max_workers=4)
+
+        # list address -> (member digest, filter script), rebuilt every cycle so deleted lists are dropped
+        self._listFilterScripts = {}
+        self._previousListFilterScripts = {}
+        # the digest covers the template as well, so changing it regenerates all scripts
+        self._listFilterTemplate = self._getListFilterScript("", ["{member}"])
+
+        self._shardPool = None
+        self._shardMailcows = {}
+        self._shardMailcowsLock = threading.Lock()
+        if self._config['SHARD_BY_DOMAIN'] == "1":
+            self._shardPool = ThreadPoolExecutor(max_workers=int(self._config['SHARD_WORKERS']))
+
+        self._scheduler = SyncScheduler(
+            self._config['SYNC_INTERVAL'],
+            self._config['SYNC_INTERVAL_MIN'],
+            self._config['SYNC_INTERVAL_MAX'] or self._config['SYNC_INTERVAL'],
+            self._config['SYNC_BACKOFF_MAX'],
+            self._config['SYNC_JITTER']
             )
 
         self._dockerapi = DockerapiHelper(self._config["DOCKERAPI_URI"])
 
-        templateHelper.applyAllTemplates(self._config, self._dockerapi)
+        self._eventLoop = None
+        if self._config['ASYNC_ENGINE'] == "1":
+            if self._shardPool:
+                logging.warning("LINUXMUSTER_MAILCOW_SHARD_BY_DOMAIN is ignored by the async engine, it applies all domains concurrently anyway")
+            # the loop is kept between the cycles, so are the connections of its helpers
+            self._eventLoop = asyncio.new_event_loop()
+            self._asyncMailcow = AsyncMailcowHelper(
+                self._config['API_URI'],
+                self._config['API_KEY'],
+                self._config['ASYNC_CONCURRENCY'],
+                self._config['API_TIMEOUT'],
+                self._config['API_RETRIES'],
+                self._rateController
+                )
+            self._asyncDockerapi = AsyncDockerapiHelper(self._config["DOCKERAPI_URI"])
+            # the LDAP connection must not be used concurrently, so all LDAP calls run in this one thread
+            self._ldapExecutor = ThreadPoolExecutor(max_workers=1)
+
+        self._applyTemplates = applyTemplates
+        self._templatesAppliedAt = None
+        if applyTemplates:
+            self._applyTemplatesIfDue()
 
     def sync(self):
+        if self._config['METRICS_PORT'] != "0":
+            metricsHelper.startServer(self._config['METRICS_PORT'])
+
+        self._scheduler.installSignalHandler()
+        if self._config['TRIGGER_SOCKET'] != "":
+            self._scheduler.listenOnSocket(self._config['TRIGGER_SOCKET'])
+
         while (True):
+            self._applyTemplatesIfDue()
+
             logging.info("=== Starting sync ===")
-            if not self._sync():
+            with metricsHelper.syncDuration.time():
+                success = self._runSync()
+
+            if not success:
                 logging.critical("!!! The sync failed, see above errors !!!")
-                interval = 30
+                metricsHelper.syncFailures.inc()
+                self._scheduler.cycleFailed()
             else:
                 logging.info("=== Sync finished successfully ==")
-                interval = int(self._config['SYNC_INTERVAL'])
-            
-            logging.info(f"sleeping {interval} seconds before next cycle")
-            time.sleep(interval)
+                metricsHelper.syncLastSuccess.set(time.time())
+                self._scheduler.cycleSucceeded(self._foundDeltas)
 
-    def _sync(self):
+            self._scheduler.wait()
 
-        logging.info("Step 1: Loading current Data from AD")
+    def close(self):
+        """
+        Closes the connections of the async engine
+        """
+        if self._eventLoop:
+            self._eventLoop.run_until_complete(self._asyncMailcow.close())
+            self._eventLoop.run_until_complete(self._asyncDockerapi.close())
+            self._eventLoop.close()
+            self._eventLoop = None
 
-        logging.info("    * Binding to ldap")
-        if not self._ldap.bind():
+    def _applyTemplatesIfDue(self):
+        """
+        Applies the config templates at startup and then every TEMPLATE_CHECK_INTERVAL seconds to fix config drift
+        """
+        if not self._applyTemplates:
+            return
+
+        checkInterval = int(self._config['TEMPLATE_CHECK_INTERVAL'])
+        if self._templatesAppliedAt != None and (checkInterval <= 0 or time.monotonic() - self._templatesAppliedAt < checkInterval):
+            return
+
+        try:
+            if self._eventLoop:
+                self._eventLoop.run_until_complete(
+                    templateHelper.applyAllTemplatesAsync(self._config, self._asyncDockerapi, self._config['TEMPLATE_BACKUP_COUNT'])
+                )
+            else:
+                templateHelper.applyAllTemplates(self._config, self._dockerapi, self._config['TEMPLATE_BACKUP_COUNT'])
+        except OSError as e:
+            logging.error(f"Could not apply the config templates: {e}")
+        self._templatesAppliedAt = time.monotonic()
+
+    def plan(self, path):
+        """
+        Runs Step 1 to 3 and writes the deltas to a plan file instead of applying them
+        """
+        logging.info(f"=== Planning sync to {path} ===")
+        success = False
+        try:
+            # written next to path and renamed on success, so a failed sync never leaves a truncated plan behind
+            fileDescriptor, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".linuxmuster_mailcow_plan")
+            try:
+                with os.fdopen(fileDescriptor, "w") as file:
+                    success = self._sync(planFile=file)
+                    if success:
+                        file.flush()
+                        os.fsync(file.fileno())
+                if success:
+                    os.replace(temporaryPath, path)
+            finally:
+                if os.path.exists(temporaryPath):
+                    os.unlink(temporaryPath)
+        except OSError as e:
+            logging.critical(f"!!! Could not write the plan: {e} !!!")
+            success = False
+
+        if not success:
+            logging.critical("!!! Planning the sync failed, see above errors !!!")
+        return success
+
+    def applyPlan(self, path):
+        """
+        Applies a plan written by plan() without loading anything from AD or mailcow
+        """
+        logging.info(f"=== Applying plan {path} ===")
+        try:
+            with open(path) as file:
+                summary, queues = planHelper.readPlan(file)
+        except (OSError, ValueError) as e:
+            logging.critical(f"!!! Could not read the plan: {e} !!!")
             return False
 
-        logging.info("    * Loading users from AD")
-        ret, adUsers = self._ldap.search(
-            self.ldapUserFilter,
-            ["mail", "proxyAddresses", "sophomorixStatus", "sophomorixMailQuotaCalculated", "displayName"]
-        )
+        createdAt = datetime.datetime.fromtimestamp(summary["createdAt"])
+        logging.info(f"* Plan created at {createdAt}:")
+        planHelper.logSummary(summary)
 
-        if not ret:
-            logging.critical("!!! Error getting users from AD !!!")
+        if self._syncState and not self._syncState.markDirty():
             return False
 
-        logging.info("    * Loading groups from AD")
-        ret, adLists = self._ldap.search(
-            self.ldapMailingListFilter,
-            ["mail", "distinguishedName", "sophomorixMailList", "sAMAccountName"]
-        )
+        try:
+            self._applyQueues(self._mailcow, queues)
+        except MailcowException:
+            logging.critical("!!! Applying the plan failed, see above errors !!!")
+            return False
 
+        logging.info("=== Plan applied successfully ===")
+        return True
+
+    def _runSync(self):
+        """
+        Runs one cycle with the configured engine
+        """
+        if self._eventLoop:
+            return self._eventLoop.run_until_complete(self._syncAsync())
+        return self._sync()
+
+    def _sync(self, planFile=None):
+        """
+        :param planFile: if set, the deltas are written to this file as a plan instead of being applied
+        """
+        self._foundDeltas = False
+        self._previousListFilterScripts, self._listFilterScripts = self._listFilterScripts, {}
+        cycleStart = time.monotonic()
+        mailcowStorages = self._createStorages()
+
+        # Step 2 runs in the background while the data is loaded from AD
+        mailcowLoads = {}
+        useSyncState = self._syncState != None and self._syncState.isUpToDate()
+        if not useSyncState:
+            mailcowLoads = self._startLoadingMailcowData(mailcowStorages)
+
+        logging.info("Step 1: Loading current Data from AD")
+        stepStart = time.monotonic()
+
+        ret = False
+        try:
+            ret, adLists, adGroups, adUsers = self._loadAdData()
+        finally:
+            if not ret:
+                self._stopLoadingMailcowData(mailcowLoads)
         if not ret:
-            logging.critical("!!! Error getting lists from AD !!!")
             return False
 
-        mailcowDomains = DomainListStorage()
-        mailcowMailboxes = MailboxListStorage(mailcowDomains)
-        mailcowAliases = AliasListStorage(mailcowDomains)
-        mailcowFilters = FilterListStorage(mailcowDomains)
+        membershipResolver = self._getMembershipResolver(adLists, adGroups)
+
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="ad_load")
+
+        if useSyncState:
+            logging.info("Step 2: Loading Data from the sync state")
+            useSyncState = self._syncState.load(mailcowStorages)
+            if not useSyncState:
+                mailcowLoads = self._startLoadingMailcowData(mailcowStorages)
 
-        logging.info("Step 2: Loading current Data from Mailcow")
+        if not useSyncState:
+            logging.info("Step 2: Waiting for current Data from Mailcow")
+            if not self._waitForMailcowData(mailcowLoads):
+                return False
+            self._storeMailcowData(mailcowStorages)
+
+        # the loading was started before Step 1
+        metricsHelper.syncStepDuration.set(time.monotonic() - cycleStart, step="mailcow_load")
+
+        if self._shardPool and planFile == None:
+            return self._syncShards(adUsers, adLists, membershipResolver, mailcowStorages)
+
+        logging.info("Step 3: Calculating deltas between AD and Mailcow")
+        stepStart = time.monotonic()
+
+        logging.info("    * Streaming users from AD")
         try:
-            rawData = self._mailcow.getAllElementsOfType("domain")
-            mailcowDomains.loadRawData(rawData)
+            adUserCount = self._addAdUsers(adUsers, membershipResolver, mailcowStorages)
+        except LdapException:
+            logging.critical("!!! Error getting users from AD !!!")
+            return False
 
-            rawData = self._mailcow.getAllElementsOfType("mailbox")
-            mailcowMailboxes.loadRawData(rawData)
+        if adUserCount <= 0:
+            logging.critical("!!! Error getting users from AD !!!")
+            return False
 
-            rawData = self._mailcow.getAllElementsOfType("alias")
-            mailcowAliases.loadRawData(rawData)
+        self._addAdLists(adLists, membershipResolver, mailcowStorages)
+        self._recordDeltaMetrics(mailcowStorages, stepStart)
 
-            # It is actially "filters" (plural); nobody knows why
-            rawData = self._mailcow.getAllElementsOfType("filters")
-            mailcowFilters.loadRawData(rawData)
+        if planFile != None:
+            logging.info("* Writing plan:")
+            planHelper.logSummary(planHelper.writePlan(planFile, self._getQueues(mailcowStorages), self._getQueueCounts(mailcowStorages)))
+            return True
+
+        if not self._reportDeltas(mailcowStorages):
+            return True
+
+        logging.info("Step 4: Syncing deltas to Mailcow")
+        stepStart = time.monotonic()
+
+        # the ids of new aliases and filters are unknown, so the state has to be loaded from mailcow again
+        if self._syncState and not self._syncState.markDirty():
+            return False
+
+        try:
+            self._applyDeltas(self._mailcow, mailcowStorages)
         except MailcowException:
             return False
-        except ConnectionError as e:
-            logging.error(e)
-            logging.critical("!!! A connection error occured, is mailcow still starting up? !!!")
+
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="apply")
+        self._logConnectionStats(self._mailcow)
+
+        return True
+
+    async def _syncAsync(self):
+        """
+        One cycle of the async engine. It runs the same steps as _sync(), but as cooperating tasks on one event loop:
+        - the mailcow data is loaded with concurrent requests while the AD is read
+        - the users are read from AD page by page in a thread and handed to the delta calculation through a bounded queue
+        - every add and update is sent as soon as the objects it depends on exist
+        """
+        self._foundDeltas = False
+        self._previousListFilterScripts, self._listFilterScripts = self._listFilterScripts, {}
+        loop = asyncio.get_running_loop()
+        cycleStart = time.monotonic()
+        mailcowStorages = self._createStorages()
+
+        mailcowLoads = {}
+        useSyncState = self._syncState != None and self._syncState.isUpToDate()
+        if not useSyncState:
+            logging.info("Step 2: Loading current Data from Mailcow in the background")
+            for elementType, storage in mailcowStorages.items():
+                mailcowLoads[elementType] = asyncio.ensure_future(self._loadMailcowDataAsync(elementType, storage))
+
+        try:
+            logging.info("Step 1: Loading current Data from AD")
+            stepStart = time.monotonic()
+
+            ret, adLists, adGroups, adUsers = await loop.run_in_executor(self._ldapExecutor, self._loadAdData)
+            if not ret:
+                return False
+
+            membershipResolver = self._getMembershipResolver(adLists, adGroups)
+
+            metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="ad_load")
+
+            # the first pages of users are read while waiting for mailcow
+            adUserPages = asyncio.Queue(maxsize=self.asyncUserPageQueueSize)
+            stopReading = threading.Event()
+            userReader = loop.run_in_executor(self._ldapExecutor, self._readUserPages, adUsers, adUserPages, stopReading, loop)
+
+            try:
+                if useSyncState:
+                    logging.info("Step 2: Loading Data from the sync state")
+                    useSyncState = self._syncState.load(mailcowStorages)
+                    if not useSyncState:
+                        for elementType, storage in mailcowStorages.items():
+                            mailcowLoads[elementType] = asyncio.ensure_future(self._loadMailcowDataAsync(elementType, storage))
+
+                if not useSyncState:
+                    logging.info("Step 2: Waiting for current Data from Mailcow")
+                    if not await self._waitForMailcowDataAsync(mailcowLoads):
+                        return False
+                    self._storeMailcowData(mailcowStorages)
+
+                metricsHelper.syncStepDuration.set(time.monotonic() - cycleStart, step="mailcow_load")
+
+                logging.info("Step 3: Calculating deltas between AD and Mailcow")
+                stepStart = time.monotonic()
+
+                logging.info("    * Streaming users from AD")
+                adUserCount = 0
+                while True:
+                    page = await adUserPages.get()
+                    if page == None:
+                        break
+                    adUserCount += self._addAdUsers(page, membershipResolver, mailcowStorages)
+            finally:
+                # let the reader finish, it may be waiting for space in the queue
+                stopReading.set()
+                while not userReader.done():
+                    try:
+                        adUserPages.get_nowait()
+                    except asyncio.QueueEmpty:
+                        await asyncio.sleep(0.01)
+
+            if not await userReader or adUserCount <= 0:
+                logging.critical("!!! Error getting users from AD !!!")
+                return False
+        finally:
+            for mailcowLoad in mailcowLoads.values():
+                mailcowLoad.cancel()
+            await asyncio.gather(*mailcowLoads.values(), return_exceptions=True)
+
+        self._addAdLists(adLists, membershipResolver, mailcowStorages)
+        self._recordDeltaMetrics(mailcowStorages, stepStart)
+
+        if not self._reportDeltas(mailcowStorages):
+            return True
+
+        logging.info("Step 4: Syncing deltas to Mailcow")
+        stepStart = time.monotonic()
+
+        if self._syncState and not self._syncState.markDirty():
             return False
-        except Exception as e:
-            logging.exception("An exception occured: ", exc_info=e)
+
+        try:
+            await self._applyQueuesAsync(self._asyncMailcow, self._getQueues(mailcowStorages))
+        except MailcowException:
             return False
 
-        logging.info("Step 3: Calculating deltas between AD and Mailcow")
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="apply")
+        self._logConnectionStats(self._asyncMailcow)
 
-        for user in adUsers:
-            mail = user["mail"]
-            maildomain = mail.split("@")[-1]
-            aliases = []
+        return True
 
-            if "proxyAddresses" in user:
-                if isinstance(user["proxyAddresses"], list):
-                    aliases = user["proxyAddresses"]
-                else:
-                    aliases = [user["proxyAddresses"]]
+    def _createStorages(self):
+        mailcowDomains = DomainListStorage()
+        return {
+            "domain": mailcowDomains,
+            "mailbox": MailboxListStorage(mailcowDomains),
+            "alias": AliasListStorage(mailcowDomains),
+            # It is actially "filters" (plural); nobody knows why
+            "filters": FilterListStorage(mailcowDomains)
+        }
 
-            if not self._addDomain(maildomain, mailcowDomains):
-                continue
+    def _storeMailcowData(self, storages):
+        """
+        Has to be called once all data was loaded from mailcow
+        """
+        # mailboxes, aliases and filters can only be classified once the managed domains are known
+        storages["mailbox"].classifyElements()
+        storages["alias"].classifyElements()
+        storages["filters"].classifyElements()
 
-            self._addMailbox(user, mailcowMailboxes)
+        if self._syncState:
+            self._syncState.save(storages)
 
-            if len(aliases) > 0:
-                for alias in aliases:
-                    self._addAlias(alias, mail, mailcowAliases)
+    def _addAdUsers(self, adUsers, membershipResolver, storages):
+        """
+        :returns: the number of users
+        """
+        adUserCount = 0
+        for user in adUsers:
+            adUserCount += 1
+            membershipResolver.addMember(user, user["mail"])
+            self._addUser(user, storages["domain"], storages["mailbox"], storages["alias"])
+        return adUserCount
 
+    def _addAdLists(self, adLists, membershipResolver, storages):
         for mailingList in adLists:
-            if not mailingList["sophomorixMailList"] == "TRUE":
-                continue
-            
-            mail = mailingList["mail"]
-            maildomain = mail.split("@")[-1]
-            ret, members = self._ldap.search(
-                self.ldapMailingListMemberFilter.replace("@@mailingListDn@@", mailingList["distinguishedName"]),
-                ["mail"]
-            )
-            
-            if not ret:
+            if not mailingList["sophomorixMailList"]:
                 continue
 
-            if not self._addDomain(maildomain, mailcowDomains):
-                continue
-
-            self._addMailbox({
-                "mail": mail,
-                "sophomorixStatus": "U",
-                "sophomorixMailQuotaCalculated": 1,
-                "displayName": mailingList["sAMAccountName"] + " (list)"
-            }, mailcowMailboxes)
+            members = membershipResolver.getMembers(mailingList["distinguishedName"])
+            self._addList(mailingList, members, storages["domain"], storages["mailbox"], storages["filters"])
 
-            self._addListFilter(mail, list(map(lambda x: x["mail"], members)), mailcowFilters)
+    def _recordDeltaMetrics(self, storages, stepStart):
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="delta_calculation")
+        for elementType, storage in storages.items():
+            for queue, count in storage.getQueueCounts().items():
+                metricsHelper.queueSize.set(count, type=elementType, queue=queue)
 
-        if mailcowDomains.queuesAreEmpty() and mailcowMailboxes.queuesAreEmpty() and mailcowAliases.queuesAreEmpty() and mailcowFilters.queuesAreEmpty():
+    def _reportDeltas(self, storages):
+        """
+        :returns: True if there are deltas to apply
+        """
+        if all(storage.queuesAreEmpty() for storage in storages.values()):
             logging.info("    * Everything up-to-date!")
-            return True
-        else:
-            logging.info("* Found deltas:")
-            logging.info(f"    * {mailcowDomains.getQueueCountsString('domains')}")
-            logging.info(f"    * {mailcowMailboxes.getQueueCountsString('mailboxes')}")
-            logging.info(f"    * {mailcowAliases.getQueueCountsString('aliases')}")
-            logging.info(f"    * {mailcowFilters.getQueueCountsString('filters')}")
+            return False
 
-        logging.info("Step 4: Syncing deltas to Mailcow")
-        
+        self._foundDeltas = True
+        logging.info("* Found deltas:")
+        self._logQueueCounts(storages)
+        return True
+
+    def _logConnectionStats(self, mailcow):
+        connectionStats = mailcow.getConnectionStats()
+        logging.info(f"    * Sent {connectionStats['requests']} requests to mailcow over {connectionStats['connections']} connections in total")
+
+    async def _loadMailcowDataAsync(self, elementType, storage):
+        storage.loadRawData(await self._asyncMailcow.getAllElementsOfType(elementType))
+
+    async def _waitForMailcowDataAsync(self, mailcowLoads):
+        success = True
+        results = await asyncio.gather(*mailcowLoads.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, MailcowException):
+                success = False
+            elif isinstance(result, Exception):
+                logging.exception("An exception occured: ", exc_info=result)
+                success = False
+        return success
+
+    def _readUserPages(self, adUsers, adUserPages, stopReading, loop):
+        """
+        Runs in the LDAP thread and puts the users into the queue page by page, followed by None
+        :param stopReading: threading.Event which is set if the pages are not needed anymore
+        :returns: False if the search failed
+        """
+        def putPage(page):
+            asyncio.run_coroutine_threadsafe(adUserPages.put(page), loop).result()
+
+        success = True
+        page = []
         try:
-            self._mailcow.killElementsOfType("filter", mailcowFilters.killQueue())
-            self._mailcow.killElementsOfType("alias", mailcowAliases.killQueue())
-            self._mailcow.killElementsOfType("mailbox", mailcowMailboxes.killQueue())
-            self._mailcow.killElementsOfType("domain", mailcowDomains.killQueue())
+            for user in adUsers:
+                page.append(user)
+                if len(page) >= self.asyncUserPageSize:
+                    if stopReading.is_set():
+                        return False
+                    putPage(page)
+                    page = []
+        except LdapException:
+            success = False
+        putPage(page)
+        putPage(None)
+        return success
 
-            self._mailcow.addElementsOfType("domain", mailcowDomains.addQueue())
-            self._mailcow.updateElementsOfType("domain", mailcowDomains.updateQueue())
+    async def _applyQueuesAsync(self, mailcow, queues):
+        """
+        Like _applyQueues() with the pipeline enabled: the kills first, then all other requests concurrently in order of their dependencies
+        """
+        await mailcow.killElementsOfType("filter", queues["filter"]["kill"])
+        await mailcow.killElementsOfType("alias", queues["alias"]["kill"])
+        await mailcow.killElementsOfType("mailbox", queues["mailbox"]["kill"])
+        await mailcow.killElementsOfType("domain", queues["domain"]["kill"])
 
-            self._mailcow.addElementsOfType("mailbox", mailcowMailboxes.addQueue())
-            self._mailcow.updateElementsOfType("mailbox", mailcowMailboxes.updateQueue())
+        await mailcow.processDependentElements(self._getDependentTasks(queues))
 
-            self._mailcow.addElementsOfType("alias", mailcowAliases.addQueue())
-            self._mailcow.updateElementsOfType("alias", mailcowAliases.updateQueue())
+    def _loadAdData(self):
+        """
+        Binds to the AD and loads the lists and groups, the users are only searched when they are iterated
+        :returns: success, lists, groups, users
+        """
+        # the connection is kept open between the cycles
+        logging.info("    * Binding to ldap")
+        if not self._ldap.bind():
+            return False, None, None, None
 
-            self._mailcow.addElementsOfType("filter", mailcowFilters.addQueue())
-            self._mailcow.updateElementsOfType("filter", mailcowFilters.updateQueue())
-        except MailcowException:
+        if self._adSnapshot:
+            if not self._adSnapshot.refresh():
+                logging.critical("!!! Error updating the AD snapshot !!!")
+                return False, None, None, None
+            return True, self._adSnapshot.getLists(), self._adSnapshot.getGroups(), self._adSnapshot.getUsers()
+
+        logging.info("    * Loading groups from AD")
+        ret, adLists = self._ldap.search(
+            self.ldapMailingListFilter,
+            self.ldapMailingListAttributes
+        )
+
+        if not ret:
+            logging.critical("!!! Error getting lists from AD !!!")
+            return False, None, None, None
+
+        logging.info("    * Loading group memberships from AD")
+        ret, adGroups = self._ldap.search(
+            self.ldapGroupFilter,
+            self.ldapGroupAttributes
+        )
+
+        if not ret:
+            logging.critical("!!! Error getting group memberships from AD !!!")
+            return False, None, None, None
+
+        # users are streamed page by page in Step 3
+        adUsers = self._ldap.searchPaged(
+            self.ldapUserFilter,
+            self.ldapUserAttributes
+        )
+        return True, adLists, adGroups, adUsers
+
+    def _getMembershipResolver(self, adLists, adGroups):
+        membershipResolver = MembershipResolver()
+        membershipResolver.loadGroups(adGroups)
+        membershipResolver.watchGroups(
+            [mailingList["distinguishedName"] for mailingList in adLists if mailingList["sophomorixMailList"]]
+        )
+        return membershipResolver
+
+    def _syncShards(self, adUsers, adLists, membershipResolver, mailcowStorages):
+        """
+        Step 3 and 4 in sharded mode: every mail domain gets its own storages and MailcowHelper
+        and its deltas are calculated and applied independently from the other domains.
+        The order of the object types is kept within each domain. Objects of different domains do not depend
+        on each other (aliases and list filters may point to other domains, but mailcow accepts any target).
+        Aliases belong to the domain of the mailbox they point to, as they are added along with its user,
+        even if their own address is in another domain.
+        """
+        logging.info("Step 3: Calculating deltas between AD and Mailcow per domain")
+        stepStart = time.monotonic()
+
+        logging.info("    * Streaming users from AD")
+        # all users have to be known before the members of the lists can be resolved
+        adUsersByDomain = {}
+        try:
+            for user in adUsers:
+                membershipResolver.addMember(user, user["mail"])
+                adUsersByDomain.setdefault(user["mail"].split("@")[-1], []).append(user)
+        except LdapException:
+            logging.critical("!!! Error getting users from AD !!!")
             return False
 
-        self._ldap.unbind()
+        if len(adUsersByDomain) <= 0:
+            logging.critical("!!! Error getting users from AD !!!")
+            return False
+
+        adListsByDomain = {}
+        for mailingList in adLists:
+            if mailingList["sophomorixMailList"]:
+                adListsByDomain.setdefault(mailingList["mail"].split("@")[-1], []).append(mailingList)
+
+        shardStorages = self._partitionStorages(mailcowStorages, set(adUsersByDomain) | set(adListsByDomain))
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="delta_calculation")
+
+        logging.info(f"Step 4: Syncing deltas of {len(shardStorages)} domains to Mailcow")
+        stepStart = time.monotonic()
+
+        # small domains first, so they are not delayed by a mass change in a big one
+        domains = sorted(shardStorages, key=lambda domain: len(adUsersByDomain.get(domain, [])))
+        shardSyncs = {
+            domain: self._shardPool.submit(
+                self._syncShard,
+                domain,
+                adUsersByDomain.get(domain, []),
+                adListsByDomain.get(domain, []),
+                membershipResolver,
+                shardStorages[domain]
+            ) for domain in domains
+        }
+
+        success = True
+        for domain, shardSync in shardSyncs.items():
+            try:
+                shardSync.result()
+            except MailcowException:
+                logging.critical(f"!!! Syncing domain {domain} failed !!!")
+                success = False
+            except Exception as e:
+                logging.exception(f"An exception occured while syncing domain {domain}: ", exc_info=e)
+                success = False
+
+        metricsHelper.syncStepDuration.set(time.monotonic() - stepStart, step="apply")
+        for elementType in mailcowStorages:
+            for queue in ["add", "update", "kill"]:
+                count = sum(storages[elementType].getQueueCounts()[queue] for storages in shardStorages.values())
+                metricsHelper.queueSize.set(count, type=elementType, queue=queue)
+
+        if not success:
+            return False
+
+        if not self._foundDeltas:
+            logging.info("    * Everything up-to-date!")
+
         return True
 
+    def _syncShard(self, domain, adUsers, adLists, membershipResolver, storages):
+        for user in adUsers:
+            self._addUser(user, storages["domain"], storages["mailbox"], storages["alias"])
+
+        for mailingList in adLists:
+            members = membershipResolver.getMembers(mailingList["distinguishedName"])
+            self._addList(mailingList, members, storages["domain"], storages["mailbox"], storages["filters"])
+
+        if all(storage.queuesAreEmpty() for storage in storages.values()):
+            return
+
+        self._foundDeltas = True
+        if self._syncState and not self._syncState.markDirty():
+            raise MailcowException("The sync state could not be marked as dirty")
+
+        logging.info(f"* Found deltas in {domain}:")
+        self._logQueueCounts(storages)
+        self._applyDeltas(self._getShardMailcow(domain), storages)
+        logging.info(f"* Domain {domain} is in sync")
+
+    def _partitionStorages(self, mailcowStorages, adDomains):
+        """
+        Splits the loaded mailcow state into one set of storages per mail domain
+        :returns: dict of domain -> dict of element type -> storage
+        """
+        partitions = {}
+        for elementType, storage in mailcowStorages.items():
+            for key, fingerprint, id in storage.getRecords():
+                partition = partitions.setdefault(self._getShardDomain(elementType, key, fingerprint), {}).setdefault(elementType, ([], []))
+                partition[0].append((key, fingerprint, id))
+            for key in storage.getUnmanagedKeys():
+                partition = partitions.setdefault(key.split("@")[-1], {}).setdefault(elementType, ([], []))
+                partition[1].append(key)
+
+        # An alias may be moved to a user of another domain. Every shard knows all existing aliases, so the new
+        # shard does not add it before the old one has killed it, it is added in the next cycle instead.
+        allAliasKeys = [key for key, fingerprint, id in mailcowStorages["alias"].getRecords()] + mailcowStorages["alias"].getUnmanagedKeys()
+
+        shardStorages = {}
+        for domain in adDomains | set(partitions):
+            storages = self._createStorages()
+            for elementType, (records, unmanagedKeys) in partitions.get(domain, {}).items():
+                storages[elementType].loadRecords(records, unmanagedKeys)
+            storages["alias"].loadRecords([], allAliasKeys)
+            shardStorages[domain] = storages
+        return shardStorages
+
+    def _getShardDomain(self, elementType, key, fingerprint):
+        """
+        :returns: the domain of the shard which manages a record, for aliases the domain of their target
+        """
+        if elementType == "alias":
+            goto = fingerprint[AliasListStorage.comparedKeys.index("goto")]
+            if goto:
+                return goto.split(",")[0].split("@")[-1]
+        return key.split("@")[-1]
+
+    def _getShardMailcow(self, domain):
+        """
+        :returns: the MailcowHelper of a domain, so every domain has its own connections and workers
+        """
+        with self._shardMailcowsLock:
+            if domain not in self._shardMailcows:
+                # all domains share the rate control, as they share the mailcow server
+                self._shardMailcows[domain] = MailcowHelper(
+                    self._config['API_URI'],
+                    self._config['API_KEY'],
+                    self._apiWorkers,
+                    self._config['API_TIMEOUT'],
+                    self._config['API_RETRIES'],
+                    self._apiWorkers,
+                    self._rateController
+                    )
+            return self._shardMailcows[domain]
+
+    def _applyDeltas(self, mailcow, storages):
+        """
+        Sends the queues of all storages to mailcow in the order of their dependencies
+        :raises MailcowException: if any request failed
+        """
+        self._applyQueues(mailcow, self._getQueues(storages))
+
+    def _getQueues(self, storages):
+        """
+        :returns: dict of element type (as used in POST requests) -> dict of queue name -> list of elements
+        """
+        queues = {}
+        for storageType, elementType in self.storageElementTypes.items():
+            queues[elementType] = {
+                "kill": storages[storageType].killQueue(),
+                "add": storages[storageType].addQueue(),
+                "update": storages[storageType].updateQueue()
+            }
+        return queues
+
+    def _getQueueCounts(self, storages):
+        """
+        :returns: dict of element type -> dict of queue name -> number of queued elements, batched updates are counted per element
+        """
+        return {elementType: storages[storageType].getQueueCounts() for storageType, elementType in self.storageElementTypes.items()}
+
+    def _applyQueues(self, mailcow, queues):
+        mailcow.killElementsOfType("filter", queues["filter"]["kill"])
+        mailcow.killElementsOfType("alias", queues["alias"]["kill"])
+        mailcow.killElementsOfType("mailbox", queues["mailbox"]["kill"])
+        mailcow.killElementsOfType("domain", queues["domain"]["kill"])
+
+        if self._config['APPLY_PIPELINE'] == "1":
+            mailcow.processDependentElements(self._getDependentTasks(queues))
+            return
+
+        mailcow.addElementsOfType("domain", queues["domain"]["add"])
+        mailcow.updateElementsOfType("domain", queues["domain"]["update"])
+
+        mailcow.addElementsOfType("mailbox", queues["mailbox"]["add"])
+        mailcow.updateElementsOfType("mailbox", queues["mailbox"]["update"])
+
+        mailcow.addElementsOfType("alias", queues["alias"]["add"])
+        mailcow.updateElementsOfType("alias", queues["alias"]["update"])
+
+        mailcow.addElementsOfType("filter", queues["filter"]["add"])
+        mailcow.updateElementsOfType("filter", queues["filter"]["update"])
+
+    def _getDependentTasks(self, queues):
+        """
+        Turns the add and update queues into tasks for MailcowHelper.processDependentElements():
+        - mailboxes depend on the add and updates (quota) of their domain
+        - aliases depend on their domain and the mailbox they point to
+        - filters depend on their domain and the (list) mailbox they belong to
+        Kills are not included, they have to be processed before.
+        """
+        tasks = []
+        domainTasks = {}
+
+        def getDomain(address):
+            return str(address).split("@")[-1]
+
+        for domain in queues["domain"]["add"]:
+            taskKey = ("domain", domain["domain"])
+            tasks.append((taskKey, "domain", "add", domain, []))
+            domainTasks.setdefault(domain["domain"], []).append(taskKey)
+
+        for i, update in enumerate(queues["domain"]["update"]):
+            taskKey = ("domain update", i)
+            tasks.append((taskKey, "domain", "update", update, []))
+            for domain in update["items"]:
+                domainTasks.setdefault(domain, []).append(taskKey)
+
+        for mailbox in queues["mailbox"]["add"]:
+            tasks.append((("mailbox", f"{mailbox['local_part']}@{mailbox['domain']}"), "mailbox", "add", mailbox, domainTasks.get(mailbox["domain"], [])))
+
+        for i, update in enumerate(queues["mailbox"]["update"]):
+            dependencies = [taskKey for mailbox in update["items"] for taskKey in domainTasks.get(getDomain(mailbox), [])]
+            tasks.append((("mailbox update", i), "mailbox", "update", update, dependencies))
+
+        for alias in queues["alias"]["add"]:
+            dependencies = domainTasks.get(getDomain(alias["address"]), []) + [("mailbox", alias["goto"])]
+            tasks.append((("alias", alias["address"]), "alias", "add", alias, dependencies))
+
+        for i, update in enumerate(queues["alias"]["update"]):
+            dependencies = [taskKey for alias in update["items"] for taskKey in domainTasks.get(getDomain(alias), [])]
+            if "goto" in update["attr"]:
+                dependencies.append(("mailbox", update["attr"]["goto"]))
+            tasks.append((("alias update", i), "alias", "update", update, dependencies))
+
+        for filter in queues["filter"]["add"]:
+            dependencies = domainTasks.get(getDomain(filter["username"]), []) + [("mailbox", filter["username"])]
+            tasks.append((("filter", filter["username"]), "filter", "add", filter, dependencies))
+
+        for i, update in enumerate(queues["filter"]["update"]):
+            tasks.append((("filter update", i), "filter", "update", update, []))
+
+        return tasks
+
+    def _logQueueCounts(self, storages):
+        logging.info(f"    * {storages['domain'].getQueueCountsString('domains')}")
+        logging.info(f"    * {storages['mailbox'].getQueueCountsString('mailboxes')}")
+        logging.info(f"    * {storages['alias'].getQueueCountsString('aliases')}")
+        logging.info(f"    * {storages['filters'].getQueueCountsString('filters')}")
+
+    def _startLoadingMailcowData(self, storages):
+        """
+        Starts loading all elements of each type into its storage in parallel
+        :returns: dict of element type -> future
+        """
+        logging.info("Step 2: Loading current Data from Mailcow in the background")
+        mailcowLoads = {}
+        for elementType, storage in storages.items():
+            # The elements are handed to the storage while they are downloaded
+            mailcowLoads[elementType] = self._mailcowLoader.submit(
+                storage.loadRawData,
+                self._mailcow.iterateAllElementsOfType(elementType)
+            )
+        return mailcowLoads
+
+    def _stopLoadingMailcowData(self, mailcowLoads):
+        """
+        Cancels the loads which have not started yet and waits for the running ones, so none is left behind unobserved
+        """
+        for mailcowLoad in mailcowLoads.values():
+            mailcowLoad.cancel()
+        self._waitForMailcowData({elementType: mailcowLoad for elementType, mailcowLoad in mailcowLoads.items() if not mailcowLoad.cancelled()})
+
+    def _waitForMailcowData(self, mailcowLoads):
+        success = True
+        for elementType, mailcowLoad in mailcowLoads.items():
+            try:
+                mailcowLoad.result()
+            except MailcowException:
+                success = False
+            except ConnectionError as e:
+                logging.error(e)
+                logging.critical("!!! A connection error occured, is mailcow still starting up? !!!")
+                success = False
+            except Exception as e:
+                logging.exception("An exception occured: ", exc_info=e)
+                success = False
+        return success
+
+    def _addUser(self, user, mailcowDomains, mailcowMailboxes, mailcowAliases):
+        mail = user["mail"]
+        maildomain = mail.split("@")[-1]
+
+        if not self._addDomain(maildomain, mailcowDomains):
+            return
+
+        self._addMailbox(user, mailcowMailboxes)
+
+        for alias in user["proxyAddresses"]:
+            self._addAlias(alias, mail, mailcowAliases)
+
     def _addDomain(self, domainName, mailcowDomains):
         return mailcowDomains.addElement({
             "domain": domainName,
@@ -226,20 +986,52 @@ class LinuxmusterMailcowSyncer:
             }, alias)
         pass
 
+    def _addList(self, mailingList, members, mailcowDomains, mailcowMailboxes, mailcowFilters):
+        mail = mailingList["mail"]
+        maildomain = mail.split("@")[-1]
+
+        if len(members) <= 0:
+            return
+
+        if not self._addDomain(maildomain, mailcowDomains):
+            return
+
+        self._addMailbox({
+            "mail": mail,
+            "sophomorixStatus": "U",
+            "sophomorixMailQuotaCalculated": 1,
+            "displayName": mailingList["sAMAccountName"] + " (list)"
+        }, mailcowMailboxes)
+
+        self._addListFilter(mail, members, mailcowFilters)
+
     def _addListFilter(self, listAddress, memberAddresses, mailcowFilters):
-        scriptData = "### Auto-generated mailinglist filter by linuxmuster ###\r\n\r\n"
-        scriptData += "require \"copy\";\r\n\r\n"
-        for memberAddress in memberAddresses:
-            scriptData += f"redirect :copy \"{memberAddress}\";\r\n"
-        scriptData += "\r\ndiscard;stop;"
+        memberAddresses = sorted(set(memberAddresses))
+        digest = hashlib.sha256("\n".join([self._listFilterTemplate] + memberAddresses).encode()).hexdigest()
+
+        # the script is only generated again if the members or the template have changed
+        digestAndScript = self._previousListFilterScripts.get(listAddress)
+        if digestAndScript == None or digestAndScript[0] != digest:
+            digestAndScript = (digest, self._getListFilterScript(digest, memberAddresses))
+        self._listFilterScripts[listAddress] = digestAndScript
+
         mailcowFilters.addElement({
             'active': 1,
             'username': listAddress,
             'filter_type': 'prefilter',
-            'script_data': scriptData,
+            'script_data': digestAndScript[1],
             'script_desc': f"Auto-generated mailinglist filter for {listAddress}"
         }, listAddress)
 
+    def _getListFilterScript(self, digest, memberAddresses):
+        return "".join([
+            "### Auto-generated mailinglist filter by linuxmuster ###\r\n",
+            f"{FilterListStorage.scriptDigestPrefix}{digest}\r\n\r\n",
+            "require \"copy\";\r\n\r\n",
+            "".join(f"redirect :copy \"{memberAddress}\";\r\n" for memberAddress in memberAddresses),
+            "\r\ndiscard;stop;"
+        ])
+
     def _readConfig(self):
         requiredConfigKeys = [
             'LINUXMUSTER_MAILCOW_LDAP_URI', 
@@ -254,14 +1046,82 @@ class LinuxmusterMailcowSyncer:
 
         allowedConfigKeys = [
             "LINUXMUSTER_MAILCOW_DOCKERAPI_URI",
-            "LINUXMUSTER_MAILCOW_API_URI"
+            "LINUXMUSTER_MAILCOW_API_URI",
+            "LINUXMUSTER_MAILCOW_LDAP_PAGE_SIZE",
+            "LINUXMUSTER_MAILCOW_LDAP_INCREMENTAL",
+            "LINUXMUSTER_MAILCOW_LDAP_FULL_SYNC_INTERVAL",
+            "LINUXMUSTER_MAILCOW_API_POOL_SIZE",
+            "LINUXMUSTER_MAILCOW_API_TIMEOUT",
+            "LINUXMUSTER_MAILCOW_API_RETRIES",
+            "LINUXMUSTER_MAILCOW_API_WORKERS",
+            "LINUXMUSTER_MAILCOW_STATE_FILE",
+            "LINUXMUSTER_MAILCOW_STATE_VERIFY_INTERVAL",
+            "LINUXMUSTER_MAILCOW_METRICS_PORT",
+            "LINUXMUSTER_MAILCOW_SYNC_INTERVAL_MIN",
+            "LINUXMUSTER_MAILCOW_SYNC_INTERVAL_MAX",
+            "LINUXMUSTER_MAILCOW_SYNC_BACKOFF_MAX",
+            "LINUXMUSTER_MAILCOW_SYNC_JITTER",
+            "LINUXMUSTER_MAILCOW_TRIGGER_SOCKET",
+            "LINUXMUSTER_MAILCOW_SHARD_BY_DOMAIN",
+            "LINUXMUSTER_MAILCOW_SHARD_WORKERS",
+            "LINUXMUSTER_MAILCOW_TEMPLATE_CHECK_INTERVAL",
+            "LINUXMUSTER_MAILCOW_TEMPLATE_BACKUP_COUNT",
+            "LINUXMUSTER_MAILCOW_APPLY_PIPELINE",
+            "LINUXMUSTER_MAILCOW_API_RATE_CONTROL",
+            "LINUXMUSTER_MAILCOW_API_TARGET_LATENCY",
+            "LINUXMUSTER_MAILCOW_API_MAX_CONCURRENCY",
+            "LINUXMUSTER_MAILCOW_API_MAX_RATE",
+            "LINUXMUSTER_MAILCOW_API_QUIET_HOURS",
+            "LINUXMUSTER_MAILCOW_API_QUIET_MAX_CONCURRENCY",
+            "LINUXMUSTER_MAILCOW_API_QUIET_MAX_RATE",
+            "LINUXMUSTER_MAILCOW_API_MIN_CONCURRENCY",
+            "LINUXMUSTER_MAILCOW_LDAP_FAILOVER_URIS",
+            "LINUXMUSTER_MAILCOW_LDAP_START_TLS",
+            "LINUXMUSTER_MAILCOW_LDAP_TIMEOUT",
+            "LINUXMUSTER_MAILCOW_LDAP_CONNECT_RETRIES",
+            "LINUXMUSTER_MAILCOW_ASYNC_ENGINE",
+            "LINUXMUSTER_MAILCOW_ASYNC_CONCURRENCY"
         ]
 
         config = {
             "LDAP_SOGO_USER_FILTER": self.ldapSogoUserFilter,
             "LDAP_USER_FILTER": self.ldapUserFilter,
             "DOCKERAPI_URI": "https://dockerapi-mailcow",
-            "API_URI": "https://nginx-mailcow"
+            "API_URI": "https://nginx-mailcow",
+            "LDAP_PAGE_SIZE": "500",
+            "LDAP_INCREMENTAL": "0",
+            "LDAP_FULL_SYNC_INTERVAL": "3600",
+            "API_POOL_SIZE": "10",
+            "API_TIMEOUT": "60",
+            "API_RETRIES": "3",
+            "API_WORKERS": "4",
+            "STATE_FILE": "",
+            "STATE_VERIFY_INTERVAL": "3600",
+            "METRICS_PORT": "0",
+            "SYNC_INTERVAL_MIN": "60",
+            "SYNC_INTERVAL_MAX": "",
+            "SYNC_BACKOFF_MAX": "900",
+            "SYNC_JITTER": "0.1",
+            "TRIGGER_SOCKET": "",
+            "SHARD_BY_DOMAIN": "0",
+            "SHARD_WORKERS": "4",
+            "TEMPLATE_CHECK_INTERVAL": "3600",
+            "TEMPLATE_BACKUP_COUNT": "5",
+            "APPLY_PIPELINE": "0",
+            "API_RATE_CONTROL": "0",
+            "API_TARGET_LATENCY": "1",
+            "API_MAX_CONCURRENCY": "4",
+            "API_MAX_RATE": "0",
+            "API_QUIET_HOURS": "",
+            "API_QUIET_MAX_CONCURRENCY": "16",
+            "API_QUIET_MAX_RATE": "0",
+            "API_MIN_CONCURRENCY": "2",
+            "LDAP_FAILOVER_URIS": "",
+            "LDAP_START_TLS": "0",
+            "LDAP_TIMEOUT": "10",
+            "LDAP_CONNECT_RETRIES": "2",
+            "ASYNC_ENGINE": "0",
+            "ASYNC_CONCURRENCY": "64"
         }
 
         for configKey in requiredConfigKeys:
@@ -280,8 +1140,21 @@ class LinuxmusterMailcowSyncer:
         return config
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Syncs users and lists from a linuxmuster.net AD to mailcow")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--plan", metavar="FILE", help="only write the deltas of one sync to FILE (JSON Lines) without changing mailcow")
+    mode.add_argument("--apply-plan", metavar="FILE", help="apply the deltas from FILE, which was written with --plan")
+    args = parser.parse_args()
+
     try:
-        syncer = LinuxmusterMailcowSyncer()
-        syncer.sync()
+        if args.plan:
+            syncer = LinuxmusterMailcowSyncer(applyTemplates=False)
+            sys.exit(0 if syncer.plan(args.plan) else 1)
+        elif args.apply_plan:
+            syncer = LinuxmusterMailcowSyncer(applyTemplates=False)
+            sys.exit(0 if syncer.applyPlan(args.apply_plan) else 1)
+        else:
+            syncer = LinuxmusterMailcowSyncer()
+            syncer.sync()
     except KeyboardInterrupt:
         pass
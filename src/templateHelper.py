@@ -1,39 +1,124 @@
-import logging, os
+import logging, os, re, json, hashlib, shutil, tempfile, asyncio
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from requests.exceptions import ConnectionError
 
-def applyAllTemplates(config, dockerapi=None):
-    files = [
-        'dovecot/ldap/passdb.conf',
-        'dovecot/extra.conf',
-        'sogo/plist_ldap'
-    ]
+# template -> container which uses it
+templateFiles = {
+    'dovecot/ldap/passdb.conf': 'dovecot-mailcow',
+    'dovecot/extra.conf': 'dovecot-mailcow',
+    'sogo/plist_ldap': 'sogo-mailcow'
+}
 
-    configChanged = False
-    for file in files:
-        thisConfigChanged = _applyTemplate(file, config)
-        configChanged = configChanged or thisConfigChanged
+# containers which can reload their config without a restart -> reload task of mailcow's dockerapi
+reloadableContainers = {
+    'dovecot-mailcow': 'dovecot'
+}
 
-    if configChanged and dockerapi:
-        logging.info("One or more config files have been changed, restarting dovecot-mailcow and sogo-mailcow now!")
+templateVariablePattern = re.compile(r"@@(\w+)@@")
+
+# content hash, size and mtime of every written config file and the last used backup slot
+manifestFilePath = "conf/.linuxmuster_mailcow_manifest.json"
+backupSuffix = ".linuxmuster_mailcow_bak"
+
+# the templates are part of the image, so they only have to be read once
+_templateCache = {}
+
+def applyAllTemplates(config, dockerapi=None, backupCount=5):
+    """
+    Renders all templates and writes the config files which differ from the rendered result.
+    Can be called periodically, unchanged files are detected by their size and mtime without reading them.
+    :returns: True if any config file was changed
+    """
+    changedContainers = _applyTemplates(config, backupCount)
+
+    if len(changedContainers) > 0 and dockerapi:
+        logging.info(f"Config files of {', '.join(changedContainers)} have been changed, reloading or restarting them now!")
         try:
-            dockerapi.waitForContainersToBeRunning(["sogo-mailcow", "dovecot-mailcow"])
-            dockerapi.restartContainer("sogo-mailcow")
-            dockerapi.restartContainer("dovecot-mailcow")
+            _reloadContainers(dockerapi, changedContainers)
         except:
             print()
             logging.warning("Could not restart containers because of an exception.")
-    elif not dockerapi:
-        logging.info("One or more config files have been changed, please make sure to restart dovecot-mailcow and sogo-mailcow!")
+    elif len(changedContainers) > 0:
+        logging.info(f"Config files of {', '.join(changedContainers)} have been changed, please make sure to restart them!")
 
-def _applyTemplate(filePath, config):
+    return len(changedContainers) > 0
 
-    configFilePath = f"conf/{filePath}"
-    templateFilePath = f"templates/{filePath}"
+async def applyAllTemplatesAsync(config, dockerapi=None, backupCount=5):
+    """
+    Like applyAllTemplates(), but with an AsyncDockerapiHelper. The files are written in a thread.
+    """
+    changedContainers = await asyncio.get_running_loop().run_in_executor(None, _applyTemplates, config, backupCount)
+
+    if len(changedContainers) > 0 and dockerapi:
+        logging.info(f"Config files of {', '.join(changedContainers)} have been changed, reloading or restarting them now!")
+        try:
+            await _reloadContainersAsync(dockerapi, changedContainers)
+        except:
+            print()
+            logging.warning("Could not restart containers because of an exception.")
+    elif len(changedContainers) > 0:
+        logging.info(f"Config files of {', '.join(changedContainers)} have been changed, please make sure to restart them!")
+
+    return len(changedContainers) > 0
+
+def _applyTemplates(config, backupCount):
+    """
+    :returns: the containers whose config files were changed
+    """
+    manifest = _readManifest()
+    oldManifest = json.dumps(manifest, sort_keys=True)
+
+    changedContainers = []
+    for file, container in templateFiles.items():
+        if _applyTemplate(file, config, manifest, int(backupCount)) and container not in changedContainers:
+            changedContainers.append(container)
+
+    if json.dumps(manifest, sort_keys=True) != oldManifest:
+        _writeManifest(manifest)
+
+    return changedContainers
+
+def _reloadContainers(dockerapi, containers):
+    """
+    Reloads or restarts all containers concurrently and waits until they are running again
+    """
+    if not dockerapi.waitForContainersToBeRunning(containers):
+        logging.warning("Trying to restart the containers anyway")
+
+    with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+        list(executor.map(lambda container: _reloadContainer(dockerapi, container), containers))
+
+    if not dockerapi.waitForContainersToBeRunning(containers):
+        logging.warning("The containers are not running after the restart")
+
+def _reloadContainer(dockerapi, container):
+    if container in reloadableContainers:
+        if dockerapi.reloadContainer(container, reloadableContainers[container]):
+            return True
+        logging.warning(f"Could not reload {container}, restarting it instead")
+    return dockerapi.restartContainer(container)
 
-    with open(templateFilePath) as f:
-        templateData = f.read()
+async def _reloadContainersAsync(dockerapi, containers):
+    if not await dockerapi.waitForContainersToBeRunning(containers):
+        logging.warning("Trying to restart the containers anyway")
+
+    await asyncio.gather(*[_reloadContainerAsync(dockerapi, container) for container in containers])
+
+    if not await dockerapi.waitForContainersToBeRunning(containers):
+        logging.warning("The containers are not running after the restart")
+
+async def _reloadContainerAsync(dockerapi, container):
+    if container in reloadableContainers:
+        if await dockerapi.reloadContainer(container, reloadableContainers[container]):
+            return True
+        logging.warning(f"Could not reload {container}, restarting it instead")
+    return await dockerapi.restartContainer(container)
+
+def _applyTemplate(filePath, config, manifest, backupCount):
+
+    configFilePath = f"conf/{filePath}"
 
     templateVariables = {
         "ldapUri": config['LDAP_URI'],
@@ -43,30 +128,106 @@ def _applyTemplate(filePath, config):
         "ldapUserFilter": config['LDAP_USER_FILTER'],
         "ldapSogoUserFilter": config['LDAP_SOGO_USER_FILTER']
     }
-    
-    for key, value in templateVariables.items():
-        templateData = templateData.replace(f"@@{key}@@", value)
+
+    configData = _renderTemplate(_getTemplate(filePath), templateVariables).strip() + "\n"
+    configHash = _getHash(configData)
+
+    entry = manifest["files"].get(filePath, {})
+    if _fileMatchesManifest(configFilePath, entry, configHash):
+        logging.debug(f"Config file {configFilePath} unchanged")
+        return False
 
     if os.path.isfile(configFilePath):
         with open(configFilePath) as f:
             oldFileContents = f.read()
 
-        if oldFileContents.strip() == templateData.strip():
+        if oldFileContents.strip() == configData.strip():
             logging.info(f"Config file {configFilePath} unchanged")
+            manifest["files"][filePath] = _getManifestEntry(configFilePath, configHash, entry.get("backupSlot"))
             return False
 
-        backupIndex = 1
-        backupFile = f"{configFilePath}.linuxmuster_mailcow_bak"
-        while os.path.exists(backupFile):
-            backupFile = f"{configFilePath}.linuxmuster_mailcow_bak.{backupIndex}"
-            backupIndex += 1
-
-        os.rename(configFilePath, backupFile)
-        logging.info(f"Backed up {configFilePath} to {backupFile}")
+        backupSlot = entry.get("backupSlot")
+        if backupCount > 0:
+            backupSlot = 0 if backupSlot == None else (backupSlot + 1) % backupCount
+            backupFile = f"{configFilePath}{backupSuffix}.{backupSlot}"
+            shutil.copy2(configFilePath, backupFile)
+            logging.info(f"Backed up {configFilePath} to {backupFile}")
+    else:
+        backupSlot = entry.get("backupSlot")
 
     Path(os.path.dirname(configFilePath)).mkdir(parents=True, exist_ok=True)
+    _writeFileAtomically(configFilePath, configData)
+    manifest["files"][filePath] = _getManifestEntry(configFilePath, configHash, backupSlot)
 
-    print(templateData, file=open(configFilePath, 'w'))
-    
     logging.info(f"Saved generated config file to {configFilePath}")
-    return True
\ No newline at end of file
+    return True
+
+def _getTemplate(filePath):
+    if filePath not in _templateCache:
+        with open(f"templates/{filePath}") as f:
+            _templateCache[filePath] = f.read()
+    return _templateCache[filePath]
+
+def _renderTemplate(templateData, templateVariables):
+    """
+    Replaces all @@variable@@ placeholders in one pass, unknown placeholders are kept
+    """
+    return templateVariablePattern.sub(lambda match: templateVariables.get(match.group(1), match.group(0)), templateData)
+
+def _fileMatchesManifest(configFilePath, entry, configHash):
+    if entry.get("hash") != configHash:
+        return False
+    try:
+        stat = os.stat(configFilePath)
+    except OSError:
+        return False
+    return stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime")
+
+def _getManifestEntry(configFilePath, configHash, backupSlot):
+    stat = os.stat(configFilePath)
+    return {
+        "hash": configHash,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "backupSlot": backupSlot
+    }
+
+def _getHash(data):
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def _writeFileAtomically(filePath, data):
+    """
+    Writes to a temporary file next to filePath and renames it, so readers never see a partially written file
+    """
+    fileDescriptor, temporaryFilePath = tempfile.mkstemp(dir=os.path.dirname(filePath), prefix=".linuxmuster_mailcow_tmp")
+    try:
+        with os.fdopen(fileDescriptor, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.isfile(filePath):
+            shutil.copymode(filePath, temporaryFilePath)
+        else:
+            os.chmod(temporaryFilePath, 0o644)
+        os.replace(temporaryFilePath, filePath)
+    except:
+        if os.path.exists(temporaryFilePath):
+            os.unlink(temporaryFilePath)
+        raise
+
+def _readManifest():
+    try:
+        with open(manifestFilePath) as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"files": {}}
+
+def _writeManifest(manifest):
+    try:
+        Path(os.path.dirname(manifestFilePath)).mkdir(parents=True, exist_ok=True)
+        _writeFileAtomically(manifestFilePath, json.dumps(manifest, indent=2))
+    except OSError as e:
+        logging.warning(f"Could not save the template manifest: {e}")